@@ -2,26 +2,144 @@
 # Please have a look at the article https://www.kaggle.com/kunjmehta/gaussian-kernel-regression-from-scratch
 import numpy as np 
 import pandas as pd
-import matplotlib.pyplot as plt
-import scipy.stats as stats
 import math
 
+from ._optional import LazyModule
+
+plt = LazyModule('matplotlib.pyplot', 'viz')
+stats = LazyModule('scipy.stats')
+spatial = LazyModule('scipy.spatial')
+
 class GKR:
+    '''
+        Gaussian kernel regression (Nadaraya-Watson) of y on x with
+        bandwidth b. With 'truncate' = k only training points within k * b
+        of a query are evaluated: x is sorted once and the window is found
+        by binary search (a KD-tree for multivariate x). Every left out
+        point weighs less than exp(-k^2 / 2) of a point at the query
+        (k = 4: 3.4e-4, k = 6: 1.5e-8), so the prediction differs from the
+        exact one by at most n_outside * exp(-k^2 / 2) / W times the range
+        of y, W being the summed weight of the points in the window. Queries
+        whose window weighs less than one point at the query (W < 1, e.g.
+        far outside the data) are predicted exactly.
+
+        With 'bins' = m (single variable x only) x and y are linearly binned
+        onto m regular grid points between min(x) and max(x) once, the
+        numerator and denominator are convolved with the kernel by FFT and
+        predictions are interpolated linearly between the grid points, the
+        cost of predict no longer depends on n. Binning and interpolation
+        err by O((h / b)^2) of the range of y with grid step h = (max(x) -
+        min(x)) / (m - 1), e.g. about 1e-3 for h = b / 4, a finer grid
+        lowers the error. Queries outside [min(x), max(x)] get the value of
+        the closest grid point.
+    '''
     
-    def __init__(self, x, y, b):
-        self.x = x
-        self.y = y
+    def __init__(self, x, y, b, truncate=None, bins=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
         self.b = b
+        self.truncate = truncate
+        self.bins = bins
+        # Training points as (n, d) matrix, d = 1 for a single variable
+        self._points = self.x.reshape(len(self.x), -1)
+        if bins is not None:
+            if self._points.shape[1] != 1:
+                raise ValueError("'bins' supports a single variable x only")
+            if bins < 2:
+                raise ValueError("'bins' has to be at least 2, got {}".format(bins))
+            self._grid, self._gridFit = _binned_fit(self._points[:, 0], self.y, b, bins)
+        elif truncate is not None:
+            if self._points.shape[1] == 1:
+                order = np.argsort(self._points[:, 0], kind='stable')
+                self._sortedX = self._points[order, 0]
+                self._sortedY = self.y[order]
+            else:
+                self._tree = spatial.cKDTree(self._points)
     
     '''Implement the Gaussian Kernel'''
     def gaussian_kernel(self, z):
-        return (1/math.sqrt(2*math.pi))*math.exp(-0.5*z**2)
+        return (1/math.sqrt(2*math.pi))*np.exp(-0.5*np.asarray(z)**2)
     
-    '''Calculate weights and return prediction'''
-    def predict(self, X):
-        kernels = [self.gaussian_kernel((xi-X)/self.b) for xi in self.x]
-        weights = [len(self.x) * (kernel/np.sum(kernels)) for kernel in kernels]
-        return np.dot(weights, self.y)/len(self.x)
+    '''Calculate weights and return prediction. X is a single query point
+       or an array of query points, the kernels of all training points are
+       evaluated at once, in chunks of at most 'chunkSize' kernel values.
+       The constant of the kernel cancels out in the weights and is left
+       out, the exponent is shifted so that the closest training point gets
+       weight 1, far away queries do not end in 0/0.'''
+    def predict(self, X, chunkSize=4000000):
+        queries = np.asarray(X, dtype=float)
+        single = queries.ndim < self.x.ndim
+        queries = queries.reshape(-1, self._points.shape[1])
+        if self.bins is not None:
+            # Regular grid: the neighbouring grid points follow from the position
+            step = self._grid[1] - self._grid[0]
+            left, fraction = _grid_position(queries[:, 0], self._grid[0], step, self.bins)
+            prediction = self._gridFit[left]
+            prediction += fraction * (self._gridFit[left + 1] - prediction)
+        elif self.truncate is None:
+            prediction = self._predict_exact(queries, chunkSize)
+        else:
+            prediction = self._predict_truncated(queries, chunkSize)
+        return prediction[0] if single else prediction
+
+    def _predict_exact(self, queries, chunkSize):
+        prediction = np.empty(len(queries))
+        rows = max(1, chunkSize // len(self._points))
+        for start in range(0, len(queries), rows):
+            chunk = queries[start:start + rows]
+            # -0.5 * z^2 for all pairs of query and training point
+            if chunk.shape[1] == 1:
+                exponent = np.subtract.outer(chunk[:, 0], self._points[:, 0])
+                np.square(exponent, out=exponent)
+            else:
+                exponent = ((chunk[:, None, :] - self._points[None, :, :]) ** 2).sum(axis=2)
+            exponent *= -0.5 / self.b ** 2
+            exponent -= exponent.max(axis=1, keepdims=True)
+            kernels = np.exp(exponent, out=exponent)
+            prediction[start:start + rows] = kernels @ self.y / kernels.sum(axis=1)
+        return prediction
+
+    def _predict_truncated(self, queries, chunkSize):
+        radius = self.truncate * self.b
+        if queries.shape[1] == 1:
+            first = np.searchsorted(self._sortedX, queries[:, 0] - radius, 'left')
+            counts = np.searchsorted(self._sortedX, queries[:, 0] + radius, 'right') - first
+        else:
+            counts = self._tree.query_ball_point(queries, radius, return_length=True)
+
+        # Kernels of all (query, training point) pairs within the radius,
+        # flattened, in chunks of at most chunkSize pairs
+        prediction = np.empty(len(queries))
+        weight = np.empty(len(queries))
+        ends = np.cumsum(counts)
+        start = 0
+        while start < len(queries):
+            limit = (ends[start - 1] if start else 0) + chunkSize
+            stop = max(start + 1, np.searchsorted(ends, limit, 'right'))
+            chunkCounts = counts[start:stop]
+            query = np.repeat(np.arange(stop - start), chunkCounts)
+            if queries.shape[1] == 1:
+                offset = np.cumsum(chunkCounts) - chunkCounts - first[start:stop]
+                point = np.arange(chunkCounts.sum()) - np.repeat(offset, chunkCounts)
+                exponent = (queries[start:stop, 0][query] - self._sortedX[point]) ** 2
+                y = self._sortedY[point]
+            else:
+                point = np.concatenate(
+                    [np.asarray(neighbours, dtype=int) for neighbours in
+                     self._tree.query_ball_point(queries[start:stop], radius)])
+                exponent = ((queries[start:stop][query] - self._points[point]) ** 2).sum(axis=1)
+                y = self.y[point]
+            kernels = np.exp(-0.5 / self.b ** 2 * exponent)
+            weight[start:stop] = np.bincount(query, kernels, stop - start)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                prediction[start:stop] = np.bincount(query, kernels * y, stop - start) / \
+                    weight[start:stop]
+            start = stop
+
+        sparse = weight < 1
+        if sparse.any():
+            prediction[sparse] = self._predict_exact(queries[sparse], chunkSize)
+        return prediction
  
     
     def visualize_kernels(self, precision):
@@ -48,3 +166,142 @@ class GKR:
         plt.ylabel('Kernel Weights wi')
         plt.xlabel('x')
         #plt.legend()
+
+
+def select_bandwidth(x, y, bandwidths=None, method='loo', bins=None, chunkSize=4000000):
+    '''
+        Aim:
+            Choose the bandwidth b of GKR by leave-one-out cross-validation
+            ('loo') or generalized cross-validation ('gcv') over a grid of
+            candidates. The squared distances of the training points are
+            computed once per chunk and reused for all candidates. For more
+            than 2000 points (or if 'bins' is given) x and y are linearly
+            binned onto a regular grid and the kernel sums are computed on
+            the grid, which makes the cost independent of n.
+        Input:
+            x, y -- training data, one variable,
+            optional: array of candidate bandwidths (default: 30 values
+                around Silverman's rule of thumb),
+            optional: 'loo' or 'gcv',
+            optional: number of grid points for the binned approximation,
+            optional: maximum number of kernel values in memory at once
+        Output:
+            chosen bandwidth,
+            Pandas DF with columns 'bandwidth' and 'score' (the CV curve)
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.ndim != 1:
+        raise ValueError('select_bandwidth supports a single variable x only')
+    if method not in ('loo', 'gcv'):
+        raise ValueError("method has to be 'loo' or 'gcv', got '{}'".format(method))
+    if bandwidths is None:
+        rule = 1.06 * x.std() * len(x) ** (-1 / 5)
+        bandwidths = np.geomspace(rule / 10, rule * 10, 30)
+    bandwidths = np.asarray(bandwidths, dtype=float)
+    if bins is None and len(x) > 2000:
+        bins = 1000
+
+    if bins is None:
+        numerator, denominator = _kernel_sums_exact(x, y, bandwidths, chunkSize)
+        # Every training point is its own evaluation point
+        count, sumY, sumY2 = np.ones(len(x)), y, y ** 2
+    else:
+        numerator, denominator, (count, sumY, sumY2) = \
+            _kernel_sums_binned(x, y, bandwidths, bins)
+
+    # Squared residuals summed per evaluation point from count, sum(y) and
+    # sum(y^2) of the training points at it. The kernel of a point with
+    # itself is 1 (the constant is left out).
+    used = count > 0
+    numerator, denominator = numerator[:, used], denominator[:, used]
+    count, sumY, sumY2 = count[used], sumY[used], sumY2[used]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if method == 'loo':
+            # residual = (1 + a) * y - a * numerator, a = 1 / (denominator - 1)
+            a = 1 / (denominator - 1)
+            score = np.sum((1 + a) ** 2 * sumY2 - 2 * (1 + a) * a * numerator * sumY +
+                           count * (a * numerator) ** 2, axis=1) / count.sum()
+        else:
+            fit = numerator / denominator
+            rss = np.sum(sumY2 - 2 * fit * sumY + count * fit ** 2, axis=1)
+            trace = np.sum(count / denominator, axis=1)
+            score = count.sum() * rss / (count.sum() - trace) ** 2
+    score[~np.isfinite(score)] = np.inf
+
+    curve = pd.DataFrame({'bandwidth': bandwidths, 'score': score})
+    return bandwidths[np.argmin(score)], curve
+
+
+def _kernel_sums_exact(x, y, bandwidths, chunkSize):
+    # Sum of K * y and of K at every training point, one row per bandwidth
+    numerator = np.empty((len(bandwidths), len(x)))
+    denominator = np.empty((len(bandwidths), len(x)))
+    rows = max(1, chunkSize // len(x))
+    for start in range(0, len(x), rows):
+        distance = np.square(np.subtract.outer(x[start:start + rows], x))
+        for i, b in enumerate(bandwidths):
+            kernels = np.exp(-0.5 / b ** 2 * distance)
+            numerator[i, start:start + rows] = kernels @ y
+            denominator[i, start:start + rows] = kernels.sum(axis=1)
+    return numerator, denominator
+
+
+def _grid_position(x, start, step, size):
+    # Left neighbour on a regular grid and the fraction of the step to it
+    position = np.clip((x - start) / step, 0, size - 1)
+    left = np.minimum(position.astype(np.intp), size - 2)
+    return left, position - left
+
+
+def _linear_binning(x, weights, start, step, size, position=None):
+    # Split every weight on the two neighbouring grid points
+    left, fraction = _grid_position(x, start, step, size) if position is None else position
+    return np.bincount(left, weights * (1 - fraction), size) + \
+        np.bincount(left + 1, weights * fraction, size)
+
+
+def _kernel_sums_binned(x, y, bandwidths, bins):
+    # Kernel sums at the points of a regular grid from linearly binned data,
+    # plus count, sum(y) and sum(y^2) of the points closest to each grid point
+    start, stop = x.min(), x.max()
+    step = (stop - start) / (bins - 1) if stop > start else 1.0
+    counts = _linear_binning(x, np.ones(len(x)), start, step, bins)
+    sums = _linear_binning(x, y, start, step, bins)
+
+    numerator = np.empty((len(bandwidths), bins))
+    denominator = np.empty((len(bandwidths), bins))
+    for i, b in enumerate(bandwidths):
+        numerator[i], denominator[i] = _grid_kernel_sums(np.stack([sums, counts]), step, b)
+
+    nearest = np.rint((x - start) / step).astype(int)
+    bin_stats = (np.bincount(nearest, minlength=bins).astype(float),
+                 np.bincount(nearest, y, bins), np.bincount(nearest, y ** 2, bins))
+    return numerator, denominator, bin_stats
+
+
+def _grid_kernel_sums(values, step, b):
+    # Convolve every row of 'values' (weights on a regular grid) with the
+    # kernel by FFT, the kernel is cut off at 8 * b (exp(-32) = 1.3e-14)
+    bins = values.shape[-1]
+    half = int(min(bins - 1, np.ceil(8 * b / step)))
+    kernel = np.exp(-0.5 * (step * np.arange(-half, half + 1) / b) ** 2)
+    size = 1 << int(np.ceil(np.log2(bins + 2 * half)))
+    convolved = np.fft.irfft(np.fft.rfft(values, size) * np.fft.rfft(kernel, size), size)
+    return convolved[..., half:half + bins]
+
+
+def _binned_fit(x, y, b, bins):
+    # Prediction of GKR at 'bins' regular grid points between min(x) and max(x)
+    start, stop = x.min(), x.max()
+    step = (stop - start) / (bins - 1) if stop > start else 1.0
+    grid = start + step * np.arange(bins)
+    left, fraction = position = _grid_position(x, start, step, bins)
+    counts = np.bincount(left, 1 - fraction, bins) + np.bincount(left + 1, fraction, bins)
+    numerator, denominator = _grid_kernel_sums(
+        np.stack([_linear_binning(x, y, start, step, bins, position), counts]), step, b)
+    # In wide gaps of the data the sums drown in the rounding error of the
+    # FFT, there the fit is interpolated from the surrounding grid points
+    valid = denominator > 1e-10 * denominator.max()
+    fit = np.interp(grid, grid[valid], numerator[valid] / denominator[valid])
+    return grid, fit
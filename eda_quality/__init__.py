@@ -3,3 +3,8 @@ from .inspection import *
 from .correction import *
 from .manipulation import *
 from .GaussianKernel import *
+from .flags import *
+from .plausibility import *
+from .duplicates import *
+from .missing import *
+from .correlation import *
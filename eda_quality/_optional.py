@@ -0,0 +1,42 @@
+import importlib
+
+
+class LazyModule:
+    '''
+        Aim:
+            Stand-in for an optional dependency which is only imported when
+            one of its attributes is used for the first time. Keeps
+            'import eda_quality' free of the plotting and clustering stack.
+
+        Input:
+            name {str} -- module to import, e.g. 'matplotlib.pyplot'
+            extra {str} -- name of the setup.py extra which installs it,
+                None for modules of the core requirements which are only
+                deferred because they are slow to import
+    '''
+
+    def __init__(self, name, extra=None):
+        self._name = name
+        self._extra = extra
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError as error:
+                if self._extra is None:
+                    hint = "It is a requirement of eda_quality, reinstall " \
+                        "it with 'pip install eda_quality'"
+                else:
+                    hint = "Install it with 'pip install eda_quality[{}]'" \
+                        .format(self._extra)
+                raise ImportError("'{}' is required for this function. {}"
+                                  .format(self._name, hint)) from error
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self._name)
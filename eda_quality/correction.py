@@ -1,163 +1,195 @@
+import numbers
+
 import pandas as pd
 import numpy as np
-import time
-import datetime
 
 import geopandas as gpd
 
+from .plausibility import (evaluate_rules, PERCENTAGE_RULE, NON_NEGATIVE_RULE,
+                           MAX_SPEED_RULE)
+from .duplicates import duplicated_rows
+
 # class Correction():
 #     def __init__(self):
 #         print("Initializing class 'Correction'")
 
 
+def _store_flag(df, name, mask, registry=None):
+    '''
+        Write a flag either as int column (0/1) or, if a FlagRegistry is
+        given, as bit of the registry's flag column
+    '''
+    if registry is None:
+        df[name] = np.asarray(mask, dtype=bool).astype(int)
+    else:
+        registry.set(df, name, mask)
+
+
+def _store_flags(df, family, variables, masks, registry=None):
+    # Same as _store_flag for a boolean matrix with one column per variable,
+    # the flags are named '<family>_<variable>'. A registry stores them in
+    # the column of the family.
+    names = [family + '_' + variable for variable in variables]
+    if registry is None:
+        df.loc[:, names] = np.asarray(masks, dtype=bool).astype(int)
+    else:
+        registry.family(family).set_many(df, names, masks)
+
+
+
+def track_durations(df, limits=None):
+    '''
+        Aim:
+            Compute the duration of every track once from track.begin and
+            track.end and check it against any number of duration limits
+            in one pass
+        Input:
+            Geopandas Dataframe,
+            optional: dict 'limits' which maps a flag name to a tuple
+                (min_duration, max_duration), either bound can be None.
+                Durations are given as pd.Timedelta, string (e.g. '5min')
+                or seconds. A track violates a limit if its duration is
+                <= min_duration or >= max_duration
+        Output:
+            Pandas Series aligned to the input, True for points of tracks
+                which violate any limit,
+            Pandas DF with one row per track: track.id, time_track_begin,
+                time_track_end, track_duration_h (timedelta),
+                track_duration_s and one boolean column per limit
+    '''
+    if limits is None:
+        limits = {}
+
+    # Parse begin and end only once per track
+    tracks = df.drop_duplicates('track.id')[
+        ['track.id', 'track.begin', 'track.end']].reset_index(drop=True)
+    tracks['time_track_begin'] = pd.to_datetime(tracks.pop('track.begin'),
+                                                utc=True, format='ISO8601')
+    tracks['time_track_end'] = pd.to_datetime(tracks.pop('track.end'),
+                                              utc=True, format='ISO8601')
+    tracks['track_duration_h'] = tracks['time_track_end'] - \
+        tracks['time_track_begin']
+    tracks['track_duration_s'] = tracks['track_duration_h'] / \
+        pd.Timedelta(seconds=1)
+
+    violation = np.zeros(len(tracks), dtype=bool)
+    for name, (min_duration, max_duration) in limits.items():
+        tracks[name] = False
+        if min_duration is not None:
+            tracks[name] |= tracks['track_duration_s'] <= \
+                _duration_seconds(min_duration)
+        if max_duration is not None:
+            tracks[name] |= tracks['track_duration_s'] >= \
+                _duration_seconds(max_duration)
+        violation |= tracks[name].to_numpy()
+
+    # Broadcast the track result to its points
+    mask = pd.Series(violation[_track_positions(df, tracks)], index=df.index)
+    return mask, tracks
+
+
+def _duration_seconds(duration):
+    # plain and numpy numbers are seconds
+    if isinstance(duration, numbers.Real):
+        return float(duration)
+    return pd.Timedelta(duration) / pd.Timedelta(seconds=1)
+
+
+def _track_positions(df, tracks):
+    '''
+        Position of the track of every point in a per track DF
+    '''
+    return pd.Index(tracks['track.id']).get_indexer(df['track.id'])
+
+
+def _add_track_duration_columns(df, tracks):
+    positions = _track_positions(df, tracks)
+    for column in ['time_track_begin', 'time_track_end', 'track_duration_h']:
+        df[column] = tracks[column].array.take(positions)
+    return df
+
 
 def track_duration_time(df):
     '''
          Aim:
-            Create a time object in DF which holds the duration of a track in format hh:mm:ss
+            Create a timedelta column in DF which holds the duration of a track
          Input:
              Geopandas Dataframe,
          Output:
-             Geopandas Dataframe with column 'track_duration_h'
+             Geopandas Dataframe with columns 'time_track_begin',
+             'time_track_end' and 'track_duration_h'
      '''
-    def timedeltaToTime(sec):
-        '''
-            Aim:
-                Convert timedelta in seconds to string in UTC
-            Input:
-                seconds as float
-            Output:
-              UTC string
-        '''
-
-        timeUTC = time.gmtime(sec) # converting seconds to a struct.time in UTC
-        timeString = time.strftime("%H:%M:%S",timeUTC)
-        return timeString
-
-    # Create time objects from string objects
-    df['time_track_begin'] = pd.to_datetime(df['track.begin'])
-    df['time_track_end'] = pd.to_datetime(df['track.end'])
-
-    # Create a column with timedelta as total seconds as a float type
-    df['track_duration_seconds'] = (df['time_track_end']-df['time_track_begin']) / pd.Timedelta(seconds=1)
-    
-    # Create time string (hh:mm:ss) from timedelta
-    df['track_duration_h'] = df['track_duration_seconds'].apply(lambda x: timedeltaToTime(x))
+    mask, tracks = track_durations(df)
+    return _add_track_duration_columns(df, tracks)
 
-    # Create time object from timedelta string
-    df['track_duration_h']= pd.to_datetime(df['track_duration_h'], format= '%H:%M:%S').dt.time
 
-    # Drop colum with track duration in total seconds
-    df = df.drop(['track_duration_seconds'], axis=1)
-    
-    return df
+def _check_track_duration(df, name, limit, flag, messages, registry=None):
+    # Check all tracks in one pass, add duration columns if not already in DF
+    mask, tracks = track_durations(df, {name: limit})
+    if 'track_duration_h' not in df.columns:
+        df = _add_track_duration_columns(df, tracks)
+
+    violating = tracks[tracks[name]]
+    if len(violating) == 0:
+        cleanDF = df
+        print(messages[0])
+    else:
+        print(len(violating), messages[1])
+        cleanDF = df[~mask.to_numpy()]
+    df_violating = violating[['track.id', 'track_duration_h']]
+
+    # To flag implausible values in original df, add column which holds boolean value
+    if flag == True:
+        _store_flag(df, name, mask, registry)
+
+    return df, cleanDF, df_violating
 
 
-def exceed_eight_hours(df, flag=True):
+def exceed_eight_hours(df, flag=True, registry=None):
     '''
         Aim:
-            Check if there are tracks with a duration > 8 h 
-            Delete tracks with duration > 8h
-            Optional: Flag all timestamps of tracks with duration > 8h
+            Check if there are tracks with a duration >= 8 h 
+            Delete tracks with duration >= 8h
+            Optional: Flag all timestamps of tracks with duration >= 8h
         Input:
             Geopandas Dataframe,
+            optional: FlagRegistry 'registry', stores the flag as bit of
+                the registry's flag column instead of an int column
         Output:
-            Geopandas DF with added column which flags all time stamps belonging to a track which falls below 5 min time duration
+            Geopandas DF with added column which flags all time stamps belonging to a track which exceeds 8 hours time duration
             Geopandas DF containing only tracks which do not exceed duration of 8 hours,
             Pandas DF which contains two columns, track.id and track_duration_h
     '''
-
-    # Create DF from grouped tracks and their time duration if not already in DF
-    if 'track_duration_h' not in df.columns:
-        df = track_duration_time(df)
-
-    # Create DF from grouped tracks which holds only two columns, track.id and track_duration_h
-    track_lengths = df.groupby('track.id')['track_duration_h'].first().to_frame().reset_index()
-
-    # Create a list from tracks which duration exceeds eight hours
-    track_lengths['exceedingEightHours'] = 0
-    track_lengths.loc[track_lengths['track_duration_h'] >= datetime.time(8, 0, 0), 'exceedingEightHours'] = track_lengths['track.id']
-    listExceedEightHours = [row for row in track_lengths['exceedingEightHours'] if row != 0]
-
-    if len(listExceedEightHours) == 0:
-        cleanDF = df
-        # For return, create empty DF
-        df_eight = pd.DataFrame({'track.id': [], 'track_duration_h': []})
-        print('no track duration exceeds eight hours')
-    else:
-        # For return, create DF from all tracks which duration exceeds eight hours
-        print(len(listExceedEightHours), 'tracks are longer than eight hours')
-        df_eight = track_lengths[track_lengths['track.id'].isin(listExceedEightHours)]
-        df_eight = df_eight[['track.id', 'track_duration_h']]
-
-        # For return, create complete DF with tracks which time duration is shorter than 8 hours
-        track_lengths['underEightHours'] = 0
-        track_lengths.loc[track_lengths['track_duration_h'] < datetime.time(8, 0, 0), 'underEightHours'] = track_lengths['track.id']
-        listUnderEightHours = [row for row in track_lengths['underEightHours'] if row != 0]
-        cleanDF = pd.DataFrame(df[df['track.id'].isin(listUnderEightHours)])
-
-    # To flag implausible values in original df, add column which holds boolean value, 1 = track_duration > 8 hours
-    if flag == True:
-        df['track_exceeds_8h'] = 0
-        df.loc[df['track_duration_h'] > datetime.time(8, 0, 0), 'track_exceeds_8h'] = 1
-
-    return df, cleanDF, df_eight
+    return _check_track_duration(
+        df, 'track_exceeds_8h', (None, '8h'), flag,
+        ('no track duration exceeds eight hours',
+         'tracks are longer than eight hours'),
+        registry)
 
 
-def below_five_min(df, flag=True):
+def below_five_min(df, flag=True, registry=None):
     '''
         Aim:
-            Check if there are tracks with a duration < 5 min
-            Delete tracks with duration < 5 min
-            Optional: Flag all timestamps of tracks with duration < 5 min
+            Check if there are tracks with a duration <= 5 min
+            Delete tracks with duration <= 5 min
+            Optional: Flag all timestamps of tracks with duration <= 5 min
         Input:
             Geopandas Dataframe,
+            optional: FlagRegistry 'registry', stores the flag as bit of
+                the registry's flag column instead of an int column
         Output:
             Geopandas DF with added column which flags all time stamps belonging to tracks falling below 5 min time duration with 1
             Geopandas DF containing only tracks which are longer than 5 min
             Pandas DF which contains two columns, track.id and track_duration_h
     '''
+    return _check_track_duration(
+        df, 'track_below_5min', ('5min', None), flag,
+        ('no track duration falls below 5 minutes',
+         'tracks are shorter than 5 minutes'),
+        registry)
 
-    # Add time column
-    if 'track_duration_h' not in df.columns:
-        df = track_duration_time(df)
-
-    # From grouped tracks create DF which holds two columns only, track.id and track_duration_h
-    track_lengths = df.groupby('track.id')['track_duration_h'].first().to_frame().reset_index()
-
-    # Create a list from tracks which duration < 5 min
-    track_lengths['belowFiveMin'] = 0
-    track_lengths.loc[track_lengths['track_duration_h'] <= datetime.time(0, 5, 0), 'belowFiveMin'] = track_lengths['track.id']
-    listBelowFiveMin = [row for row in track_lengths['belowFiveMin'] if row != 0]
-
-    if len(listBelowFiveMin) == 0:
-        cleanDF = df
-        # For return, create empty DF
-        df_five = pd.DataFrame({'track.id': [], 'track_duration_h': []})
-        print('no track duration falls below 5 minutes')
-    else:
-        # For return, create DF from all tracks which duration falls below 5 min
-        print(len(listBelowFiveMin), 'tracks are shorter than 5 minutes')
-        df_five = track_lengths[track_lengths['track.id'].isin(listBelowFiveMin)]
-        df_five = df_five[['track.id', 'track_duration_h']]
-
-        # For return, create complete DF with tracks which time duration is longer than 5 minutes
-        track_lengths['overFiveMin'] = 0
-        track_lengths.loc[track_lengths['track_duration_h'] > datetime.time(0, 5, 0), 'overFiveMin'] = track_lengths['track.id']
-        listOverFiveMin = [row for row in track_lengths['overFiveMin'] if row != 0]
-        cleanDF = pd.DataFrame(df[df['track.id'].isin(listOverFiveMin)])
-
-    # To flag implausible values in original df, add column which holds boolean value, 1 = track_duration < 5 min
-    if flag == True:
-        df['track_below_5min'] = 0
-        df.loc[df['track_duration_h'] < datetime.time(0, 5, 0), 'track_below_5min'] = 1
-
-    return df, cleanDF, df_five
 
-
-
-
-def implausible_Max_Speed(df, flag=True):
+def implausible_Max_Speed(df, flag=True, registry=None):
     '''
         Aim:
             Check if there are tracks with speeds > 250km/h
@@ -166,6 +198,8 @@ def implausible_Max_Speed(df, flag=True):
         Input:
             Geopandas Dataframe,
             optional: Boolean variable 'flag'
+            optional: FlagRegistry 'registry', stores the flag as bit of
+                the registry's flag column instead of an int column
         Output:
             Input Geopandas Dataframe with added flag column if parameter 'flag' set to True,
             Geopandas Dataframe containing only tracks which do not exceed max speed of  250km/h,
@@ -174,172 +208,171 @@ def implausible_Max_Speed(df, flag=True):
 
     # Create DF from grouped tracks and their max speed value
     track_lengths = df.groupby('track.id')['Speed.value'].max().to_frame(name='track_max_speed').reset_index()
+    maxSpeed = MAX_SPEED_RULE.upper
+    exceeding = track_lengths['track_max_speed'] >= maxSpeed
 
-    # Create list and DF with tracks which max speed exceeds 250km/h
-    track_lengths['exceeds250km'] = 0
-    track_lengths.loc[track_lengths['track_max_speed'] >= 250, 'exceeds250km'] = track_lengths['track.id']
-    listExceeding250 = [row for row in track_lengths['exceeds250km'] if row != 0]
-
-    if len(listExceeding250) == 0:
+    if not exceeding.any():
         print('no track exceeds max speed 250km/h')
         cleanDF = df
         # Create empty DF for return
         df_250 = pd.DataFrame({'track.id': [], 'track_max_speed': []})
     else:
-        print(len(listExceeding250), 'tracks exceed max speed 250')
-        df_250 = track_lengths[track_lengths['track.id'].isin(listExceeding250)]
-        df_250 = df_250[['track.id', 'track_max_speed']]
-        # Create list and DF with tracks which max speed is below 250km
-        track_lengths['speedUnder250km_h'] = 0
-        track_lengths.loc[track_lengths['track_max_speed'] < 250, 'speedUnder250km_h'] = track_lengths['track.id']
-        listUnder250 = [row for row in track_lengths['speedUnder250km_h'] if row != 0]
-        cleanDF = pd.DataFrame(df[df['track.id'].isin(listUnder250)])
+        print(exceeding.sum(), 'tracks exceed max speed 250')
+        df_250 = track_lengths.loc[exceeding, ['track.id', 'track_max_speed']]
+        # Keep tracks which max speed is below 250km/h
+        under = track_lengths.loc[track_lengths['track_max_speed'] < maxSpeed, 'track.id']
+        cleanDF = pd.DataFrame(df[df['track.id'].isin(under)])
 
     # To flag implausible values, add column which holds boolean value, 1 = speed > 250
     if flag == True:
-        df['speedExceeds250km_h'] = 0
-        df.loc[df['Speed.value'] > 250, 'speedExceeds250km_h'] = 1
+        counts, masks = evaluate_rules(df, [MAX_SPEED_RULE])
+        _store_flag(df, MAX_SPEED_RULE.name,
+                    masks.to_numpy(dtype=bool).any(axis=1), registry)
 
     return df, cleanDF, df_250
 
 
-def flag_faulty_percentages(df, setValueToNan=True, dropColumns=True, dropFlag=False):
+def flag_faulty_percentages(df, setValueToNan=True, dropColumns=True, dropFlag=False, registry=None):
     '''
         Aim: 
             Inspect if there are faulty percentages (percentages below 0 and above 100)
 
         Input: 
-            Geodataframa
+            Geodataframa,
+            optional: FlagRegistry 'registry', stores the flags as bits of
+                the registry's flag column (per-variable flags in the column
+                of their family) instead of int columns
 
         Output: 
             Geodataframe with added column which contains when percentages are faulty
     '''
-    df["faulty_percentages"] = 0
-    units = df.filter(like='.unit').columns
-    values = df.filter(like='.value').columns
-
-    listNames =[]
-    for col in units:
-        if df[col].iloc[0]== '%':
-            name = col.split(".")[0] + '.value'
-            listNames.append(name)
-
-    for variable in listNames:
-        variableName = 'faulty_percentages_' + variable
-        df[variableName] = 0
-        df.loc[df[variable] < 0, 'faulty_percentages'] = 1
-        df.loc[df[variable] > 100, 'faulty_percentages'] = 1
-        df.loc[df[variable] < 0, variableName] = 1
-        df.loc[df[variable] > 100, variableName] = 1
-        faultyPercentagesV = (df[variableName].values == 1).sum()
-        print(variableName, faultyPercentagesV)
-
-        if setValueToNan == True:
-            df.loc[df[variable] < 0, variable] = np.nan
-            df.loc[df[variable] > 100, variable] = np.nan
+    # Percentages are found by the unit of the variables
+    counts, masks = evaluate_rules(df, [PERCENTAGE_RULE])
+    listNames = masks.columns.get_level_values('column').to_list()
+    faulty = masks.to_numpy(dtype=bool)
+    for variable, count in zip(listNames, counts):
+        print('faulty_percentages_' + variable, count)
+
+    # Without percentage columns (e.g. after drop_unit_columns) only the
+    # row flag is written
+    if setValueToNan == True and listNames:
+        df.loc[:, listNames] = df[listNames].mask(faulty)
         #df[variable +'_corrected' ] = df[variable].interpolate(method ='linear', limit_direction ='both')
-        #print(variable, df[variable].isna().sum())
-        
-        if dropColumns == True:
-            df.drop([variableName], axis=1, inplace=True)
-        
-    faultyPercentages = (df['faulty_percentages'].values == 1).sum()
-    print('Flagged faulty percentages: ', faultyPercentages)
-    if dropFlag == True:
-        df.drop(['faulty_percentages'], axis=1, inplace=True)
-    
+
+    faultyRows = faulty.any(axis=1)
+    if dropFlag == False:
+        _store_flag(df, PERCENTAGE_RULE.name, faultyRows, registry)
+    if dropColumns == False and listNames:
+        _store_flags(df, 'faulty_percentages', listNames, faulty, registry)
+
+    print('Flagged faulty percentages: ', faultyRows.sum())
     return df
 
 
-def flag_implausible_negative_values(df, setToNan=False, dropFlag=False):
+def flag_implausible_negative_values(df, setToNan=False, dropFlag=False, registry=None):
     '''
         Aim: Inspect if there are unexpected negative values
 
-        Input: Geodataframa
+        Input: Geodataframa,
+                optional: FlagRegistry 'registry', stores the flag as bit of
+                the registry's flag column instead of an int column
 
         Output: Geodataframe with added column which contains 1 when values are negative
     '''   
     
-    listNonNegative=['Speed.value', 
-                     'CO2.value',
-                     'Rpm.value',
-                     'Consumption (GPS-based).value',
-                     'Consumption.value',
-                     'CO2 Emission (GPS-based).value']
-
-    
-    df["implausible_neg_value"] = 0
-    for variable in listNonNegative:
-        df.loc[df[variable] < 0, 'implausible_neg_value'] = 1
-        if setToNan == True:
-            df.loc[df[variable] < 0, variable] = np.nan
-        
-    implausibleNegativeValues = (df['implausible_neg_value'].values == 1).sum()
-    print('Flagged implausible negative values: ', implausibleNegativeValues)
-    if dropFlag == True:
-        df.drop(['implausible_neg_value'], axis=1, inplace=True)
+    counts, masks = evaluate_rules(df, [NON_NEGATIVE_RULE])
+    listNonNegative = masks.columns.get_level_values('column').to_list()
+    negative = masks.to_numpy(dtype=bool)
+    if setToNan == True and listNonNegative:
+        df.loc[:, listNonNegative] = df[listNonNegative].mask(negative)
+
+    negativeRows = negative.any(axis=1)
+    if dropFlag == False:
+        _store_flag(df, NON_NEGATIVE_RULE.name, negativeRows, registry)
+    print('Flagged implausible negative values: ', negativeRows.sum())
     return df
 
 
-def drop_dublicates(complete_track_df, keep='last'):
+def drop_dublicates(complete_track_df, keep='last', subset=None, seen=None):
+    '''
+        Aim:
+            Delete duplicated rows (in place). Rows are compared by a uint64
+            fingerprint of the columns in 'subset', optionally also against
+            the fingerprints of earlier batches
+        Input:
+            Geodataframe,
+            optional: 'keep' as in pandas.DataFrame.drop_duplicates,
+            optional: list of columns to compare (default: DUPLICATE_COLUMNS),
+            optional: FingerprintSet 'seen' of earlier batches, rows which
+                are in it are deleted as well and the fingerprints of the
+                remaining rows are added to it
+        Output:
+            Geodataframe without duplicated rows
+    '''
     beforeDel=complete_track_df.shape[0]
-    complete_track_df.drop_duplicates(subset=['geometry', 'Engine Load.value', 'Calculated MAF.value',
-           'Speed.value', 'CO2.value', 'Intake Pressure.value', 'Rpm.value',
-           'Intake Temperature.value', 'Consumption (GPS-based).value',
-           'GPS Altitude.value', 'Throttle Position.value', 'GPS Bearing.value',
-           'Consumption.value', 'GPS Accuracy.value',
-           'CO2 Emission (GPS-based).value', 'GPS Speed.value', 
-           'track.length', 'track.begin', 'track.end', 'sensor.type',
-           'sensor.engineDisplacement', 'sensor.model', 'sensor.id',
-           'sensor.fuelType', 'sensor.constructionYear', 'sensor.manufacturer'],keep='last', inplace=True)
+    duplicated, fingerprints = duplicated_rows(complete_track_df, subset, keep, seen)
+    if seen is not None:
+        seen.add(fingerprints[~duplicated])
+
+    # Delete by position, labels of the index need not be unique
+    index = complete_track_df.index
+    complete_track_df.reset_index(drop=True, inplace=True)
+    complete_track_df.drop(np.flatnonzero(duplicated), inplace=True)
+    complete_track_df.index = index[~duplicated]
     afterDel=complete_track_df.shape[0]
     deleted=beforeDel-afterDel
     print('Deleted rows: ', deleted)
     return complete_track_df
 
 
-def flag_outlier_in_sample(df, dropOutlierColumn=False, setOutlierToNan=False, dropFlag=False):
+def flag_outlier_in_sample(df, dropOutlierColumn=False, setOutlierToNan=False, dropFlag=False, quantiles=(0.10, 0.90), factor=1.5, registry=None):
     '''
-        Aim: Find outlier with regard to the sample's distribution 
-
-        Input: Geodataframa
+        Aim: Find outlier with regard to the sample's distribution. The
+                        quantiles of all float columns are computed in one
+                        call, the fences are applied as one broadcasted
+                        matrix comparison
+
+        Input: Geodataframa,
+                        optional: 'quantiles' (lower, upper) and the IQR
+                        multiplier 'factor' which define the fences,
+                        optional: FlagRegistry 'registry', stores the flags
+                        as bits of the registry's flag column (per-variable
+                        flags in the column of their family) instead of
+                        int columns
 
         Output: Geodataframe with added column which values are '1' 
                         when a certain value of a variable in the list is considered to 
                         be an outlier regarding the samples's distribution
     '''
     ls = df.select_dtypes(['float64']).columns.to_list()
-    
-    df['outlier_in_sample'] = 0
-    for variable in ls:
-        variableName='outlier_in_sample_'+ variable
-        df[variableName] = 0
-        Q1 = df[variable].quantile(0.10)
-        Q3 = df[variable].quantile(0.90)
-        IQR = Q3 - Q1
-        low_lim = Q1 - 1.5 * IQR 
-        up_lim = Q3 + 1.5 * IQR  
-        df.loc[df[variable] < low_lim, variableName] = 1
-        df.loc[df[variable] > up_lim, variableName] = 1
-        df.loc[df[variable] < low_lim, 'outlier_in_sample'] = 1
-        df.loc[df[variable] > up_lim, 'outlier_in_sample'] = 1
-        print(variableName, (df[variableName].values == 1).sum())
-
-        if setOutlierToNan == True:
-            df.loc[df[variableName] == 1 , variable] = np.nan
-
-        if dropOutlierColumn == True:
-            df.drop([variableName], axis=1, inplace=True)
-
-    outlier = (df['outlier_in_sample'].values == 1).sum()
-    print('Flagged outlier in sample: ', outlier)
-    
-    if dropFlag==True:
-        df.drop(['outlier_in_sample'], axis=1, inplace=True)
-        
+
+    q = df[ls].quantile(list(quantiles)).to_numpy()
+    lowerLimit, upperLimit = _fences(q[0], q[1], factor)
+    values = df[ls].to_numpy()
+    outlier = (values < lowerLimit) | (values > upperLimit)
+    for variable, count in zip(ls, outlier.sum(axis=0)):
+        print('outlier_in_sample_'+ variable, count)
+
+    outlierRows = outlier.any(axis=1)
+    if dropFlag == False:
+        _store_flag(df, 'outlier_in_sample', outlierRows, registry)
+    if dropOutlierColumn == False:
+        _store_flags(df, 'outlier_in_sample', ls, outlier, registry)
+    if setOutlierToNan == True:
+        df.loc[:, ls] = df[ls].mask(outlier)
+
+    print('Flagged outlier in sample: ', outlierRows.sum())
     return df
 
 
+def _fences(q1, q3, factor):
+    '''
+        Lower and upper outlier fence from the lower and upper quantile
+    '''
+    iqr = q3 - q1
+    return q1 - factor * iqr, q3 + factor * iqr
+
+
 def remove_outliers(points, column):
     """ Remove outliers by using the statistical approach
     as described in
@@ -371,50 +404,71 @@ def remove_outliers(points, column):
     return new_points
 
 
-def flag_outlier_in_track(df, dropLimits=True, dropOutlierColumn=True, setOutlierToNan=False, dropFlag=False):
-    
-    def low_limit(x):
-            q1 = x.quantile(0.10)
-            q3 = x.quantile(0.90)
-            iqr = q3 - q1
-            lower_limit = q1 - 1.5 * iqr
-            return lower_limit
-
-    def upper_limit(x):
-            q1 = x.quantile(0.10)
-            q3 = x.quantile(0.90)
-            iqr = q3 - q1
-            upper_limit = q3 + 1.5 * iqr
-            return upper_limit
-        
+def flag_outlier_in_track(df, dropLimits=True, dropOutlierColumn=True, setOutlierToNan=False, dropFlag=False, quantiles=(0.10, 0.90), factor=1.5, registry=None):
+    '''
+        Aim: Find outlier with regard to the distribution of the track
+                        the value belongs to. The quantiles of all float
+                        columns are computed per track in one grouped
+                        quantile call, the fences are applied as matrix
+                        comparison
+
+        Input: Geodataframa,
+                        optional: 'quantiles' (lower, upper) and the IQR
+                        multiplier 'factor' which define the fences,
+                        optional: FlagRegistry 'registry', stores the flags
+                        as bits of the registry's flag column (per-variable
+                        flags in the column of their family) instead of
+                        int columns
+
+        Output: Geodataframe with added column which values are '1'
+                        when a value of the row is considered to be an outlier
+                        regarding the distribution of its track
+    '''
     ls = df.select_dtypes(['float64']).columns.to_list()
-    df['outlier_in_track_all'] = 0
-    for variable in ls:
-            lowName = 'track_lowerLimit_' + variable
-            upName = 'track_upperLimit_' + variable
-            df_1 = df.groupby(['track.id'])
-            df[lowName] = df_1[variable].transform(low_limit)
-            df[upName] = df_1[variable].transform(upper_limit)
-            df.loc[df[upName] < df[variable], "outlier_in_track_all"] = 1 
-            df.loc[df[lowName] > df[variable], "outlier_in_track_all"] = 1 
-            variableName='outlier_in_track_'+ variable
-            df[variableName] = 0
-            df.loc[df[upName] < df[variable], variableName] = 1 
-            df.loc[df[lowName] > df[variable], variableName] = 1
-            print(variableName, (df[variableName].values == 1).sum())
-
-            if setOutlierToNan == True:
-                df.loc[df[variableName] == 1 , variable] = np.nan
-
-            if dropLimits == True:
-                df.drop([upName, lowName], axis=1, inplace=True)
-
-            if dropOutlierColumn == True:
-                df.drop([variableName], axis=1, inplace=True)
-
-    outlier = (df['outlier_in_track_all'].values == 1).sum()
-    print('Rows which contain outliers in tracks  (there may be multiple outlier in a single row) : ',outlier)
-    
-    if dropFlag == True:
-        df.drop(['outlier_in_track_all'], axis=1, inplace=True)
+    track, _ = pd.factorize(df['track.id'])
+    numTracks = track.max() + 1 if len(track) else 0
+
+    # Limits per track, one additional row of NaN for points without track
+    q = df[ls].groupby(track).quantile(list(quantiles))
+    q = q[q.index.get_level_values(0) >= 0]
+    q1 = q.xs(quantiles[0], level=1).reindex(range(numTracks)).to_numpy()
+    q3 = q.xs(quantiles[1], level=1).reindex(range(numTracks)).to_numpy()
+    lowerLimit, upperLimit = _fences(q1, q3, factor)
+    nanRow = np.full((1, len(ls)), np.nan)
+    lowerLimit = np.vstack([lowerLimit, nanRow])
+    upperLimit = np.vstack([upperLimit, nanRow])
+
+    outlier = _outside_limits(df[ls].to_numpy(), track, lowerLimit, upperLimit)
+    for variable, count in zip(ls, outlier.sum(axis=0)):
+        print('outlier_in_track_'+ variable, count)
+
+    outlierRows = outlier.any(axis=1)
+    if dropFlag == False:
+        _store_flag(df, 'outlier_in_track_all', outlierRows, registry)
+    if dropLimits == False:
+        df.loc[:, ['track_lowerLimit_' + variable for variable in ls]] = \
+            lowerLimit[track]
+        df.loc[:, ['track_upperLimit_' + variable for variable in ls]] = \
+            upperLimit[track]
+    if dropOutlierColumn == False:
+        _store_flags(df, 'outlier_in_track', ls, outlier, registry)
+    if setOutlierToNan == True:
+        df.loc[:, ls] = df[ls].mask(outlier)
+
+    print('Rows which contain outliers in tracks  (there may be multiple outlier in a single row) : ',outlierRows.sum())
     return df
+
+
+def _outside_limits(values, track, lowerLimit, upperLimit, chunkSize=1000000):
+    '''
+        Boolean matrix, True where a value lies outside the limits of its
+        track. Rows are compared in chunks to bound the memory of the
+        broadcasted limits.
+    '''
+    outlier = np.zeros(values.shape, dtype=bool)
+    for start in range(0, len(values), chunkSize):
+        rows = slice(start, start + chunkSize)
+        chunkTrack = track[rows]
+        outlier[rows] = (values[rows] < lowerLimit[chunkTrack]) | \
+            (values[rows] > upperLimit[chunkTrack])
+    return outlier
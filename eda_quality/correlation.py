@@ -0,0 +1,355 @@
+import pandas as pd
+import numpy as np
+
+
+class CorrelationAccumulator:
+    '''
+        Aim:
+            Pearson correlation matrix of data which is read chunk by chunk,
+            e.g. from pd.read_csv(path, chunksize=...). For every pair of
+            variables the running count, means, sums of squares and the
+            cross product are kept over the rows where both are present
+            (pairwise complete, as DataFrame.corr). Chunks are combined
+            with the update formulas of Chan et al., so accumulators of
+            different processes can be merged as well.
+
+        Input:
+            columns {list} -- optional, variables (default: the numeric
+                columns of the first chunk)
+            sketches {dict} -- optional, QuantileSketch per variable. Values
+                are replaced by their approximate rank before they are
+                accumulated, the result is then Spearman's correlation.
+    '''
+
+    def __init__(self, columns=None, sketches=None):
+        self.columns = None if columns is None else list(columns)
+        self.sketches = sketches
+        self.n = None
+        self.mean = None
+        self.m2 = None
+        self.cross = None
+
+    def __repr__(self):
+        rows = 0 if self.n is None else int(self.n.diagonal().max(initial=0))
+        return 'CorrelationAccumulator({} variables, {} rows)'.format(
+            0 if self.columns is None else len(self.columns), rows)
+
+    def _chunk_values(self, df):
+        if self.columns is None:
+            self.columns = df.select_dtypes(['number', 'bool']).columns.to_list()
+        values = df.reindex(columns=self.columns).to_numpy(dtype=float, copy=True)
+        if self.sketches is not None:
+            for i, column in enumerate(self.columns):
+                values[:, i] = self.sketches[column].cdf(values[:, i])
+        return values
+
+    def update(self, df):
+        '''
+            Aim:
+                Add a chunk of rows
+            Input:
+                DF with (a subset of) the variables, missing values as NaN
+            Output:
+                the accumulator itself
+        '''
+        values = self._chunk_values(df)
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+
+        # Shift by the column means of the chunk for numerical stability
+        shift = np.where(valid, values, 0.0).sum(axis=0) / np.maximum(count, 1)
+        x = np.where(valid, values - shift, 0.0)
+        v = valid.astype(float)
+
+        # Statistics of every pair over the rows where both are present,
+        # element [i, j] describes variable i
+        n = v.T @ v
+        sums = x.T @ v
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, sums / n, 0.0)
+        m2 = (x * x).T @ v - sums * mean
+        cross = x.T @ x - sums * mean.T
+        self._combine(n, mean + shift[:, None], m2, cross)
+        return self
+
+    def _combine(self, n, mean, m2, cross):
+        if self.n is None:
+            self.n, self.mean, self.m2, self.cross = n, mean, m2, cross
+            return
+        total = self.n + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(total > 0, self.n * n / total, 0.0)
+            newMean = np.where(total > 0,
+                               (self.n * self.mean + n * mean) / total, 0.0)
+        delta = mean - self.mean
+        self.m2 = self.m2 + m2 + delta ** 2 * weight
+        self.cross = self.cross + cross + delta * delta.T * weight
+        self.mean = newMean
+        self.n = total
+
+    def merge(self, *others):
+        '''
+            Aim:
+                Combine accumulators of the same variables, e.g. of
+                different processes
+            Input:
+                one or more CorrelationAccumulator
+            Output:
+                new CorrelationAccumulator
+        '''
+        merged = CorrelationAccumulator(self.columns, self.sketches)
+        for accumulator in (self,) + others:
+            if accumulator.n is None:
+                continue
+            if merged.columns != accumulator.columns:
+                raise ValueError('Accumulators of different variables can '
+                                 'not be merged')
+            merged._combine(accumulator.n, accumulator.mean,
+                            accumulator.m2, accumulator.cross)
+        return merged
+
+    def count(self):
+        '''
+            Number of rows per pair of variables where both are present
+        '''
+        return pd.DataFrame(self.n.astype('int64'), index=self.columns,
+                            columns=self.columns)
+
+    def correlation(self):
+        '''
+            Aim:
+                Correlation matrix of all rows added so far
+            Output:
+                Pandas DF, NaN for pairs with less than two rows or without
+                variance
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = self.cross / np.sqrt(self.m2 * self.m2.T)
+        r[(self.n < 2) | ~np.isfinite(r)] = np.nan
+        diagonal = np.arange(len(r))
+        r[diagonal, diagonal] = np.where(np.isnan(r.diagonal()), np.nan, 1.0)
+        return pd.DataFrame(np.clip(r, -1, 1), index=self.columns,
+                            columns=self.columns)
+
+
+class QuantileSketch:
+    '''
+        Aim:
+            Mergeable summary of the distribution of one variable as at most
+            'size' weighted points. As long as there are at most 'size'
+            distinct values the summary is exact, otherwise it keeps
+            points of equal weight (equi-depth). Used to approximate the
+            rank of values for Spearman's correlation.
+
+        Input:
+            size {int} -- maximum number of points
+    '''
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+
+    def __repr__(self):
+        return 'QuantileSketch({} points, {} values)'.format(
+            len(self.values), int(self.weights.sum()))
+
+    def update(self, values):
+        '''
+            Add values, NaN is ignored
+        '''
+        values = np.asarray(values, dtype=float)
+        values, counts = np.unique(values[~np.isnan(values)],
+                                   return_counts=True)
+        self._add(values, counts.astype(float))
+        return self
+
+    def merge(self, *others):
+        '''
+            New sketch which summarizes the values of all sketches
+        '''
+        merged = QuantileSketch(self.size)
+        for sketch in (self,) + others:
+            merged._add(sketch.values, sketch.weights)
+        return merged
+
+    def _add(self, values, weights):
+        values, inverse = np.unique(np.concatenate([self.values, values]),
+                                    return_inverse=True)
+        weights = np.bincount(inverse, np.concatenate([self.weights, weights]),
+                              minlength=len(values))
+        if len(values) > self.size:
+            # Points of equal weight at the quantiles of the merged points
+            total = weights.sum()
+            targets = (np.arange(self.size) + 0.5) / self.size * total
+            points = np.interp(targets, np.cumsum(weights) - weights / 2,
+                               values)
+            values, inverse = np.unique(points, return_inverse=True)
+            weights = np.bincount(inverse, minlength=len(values)) * \
+                (total / self.size)
+        self.values, self.weights = values, weights
+
+    def _positions(self):
+        # Mid rank of every point as fraction of all values
+        return (np.cumsum(self.weights) - self.weights / 2) / self.weights.sum()
+
+    def cdf(self, values):
+        '''
+            Approximate (mid) rank of values as fraction in [0, 1], NaN stays NaN
+        '''
+        values = np.asarray(values, dtype=float)
+        if len(self.values) == 0:
+            return np.full(values.shape, np.nan)
+        return np.where(np.isnan(values), np.nan,
+                        np.interp(values, self.values, self._positions()))
+
+    def quantile(self, q):
+        '''
+            Approximate value at quantile(s) q
+        '''
+        return np.interp(q, self._positions(), self.values)
+
+
+def streaming_correlation(chunks, method='pearson', columns=None, sketchSize=1000):
+    '''
+        Aim:
+            Correlation matrix of a dataset which does not fit into memory.
+            For 'spearman' the data is read twice, the first pass builds
+            a QuantileSketch per variable, the second accumulates the
+            correlation of the approximate ranks. Ranks are taken over all
+            values of a variable, not per pair as in DataFrame.corr, and are
+            exact as long as a variable has at most 'sketchSize' distinct
+            values.
+        Input:
+            chunks {callable} -- returns a new iterator of DFs on every
+                call, e.g. lambda: pd.read_csv(path, chunksize=1000000)
+            method {str} -- 'pearson' or 'spearman'
+            columns {list} -- optional, variables (default: numeric columns)
+            sketchSize {int} -- optional, points per QuantileSketch
+        Output:
+            Pandas DF, correlation matrix
+    '''
+    if method == 'pearson':
+        sketches = None
+    elif method == 'spearman':
+        sketches = {}
+        for chunk in chunks():
+            if columns is None:
+                columns = chunk.select_dtypes(['number', 'bool']).columns.to_list()
+            for column in columns:
+                sketch = sketches.setdefault(column, QuantileSketch(sketchSize))
+                if column in chunk.columns:
+                    sketch.update(chunk[column].to_numpy(dtype=float))
+    else:
+        raise ValueError("method has to be 'pearson' or 'spearman', got '{}'"
+                         .format(method))
+
+    accumulator = CorrelationAccumulator(columns, sketches)
+    for chunk in chunks():
+        accumulator.update(chunk)
+    return accumulator.correlation()
+
+
+def grouped_correlation(df, by='track.id', columns=None, batchRows=200000):
+    '''
+        Aim:
+            Pearson correlation matrix of every group (e.g. per track or per
+            sensor.model) in one go. Rows are sorted by group, the segments
+            of groups of similar size are zero padded into a 3-D batch and
+            the sums and cross products of all groups of a batch are
+            computed by one batched matrix product ('gni,gnj->gij').
+            Values are centered by their group mean beforehand. Missing
+            values are handled pairwise complete as in DataFrame.corr.
+        Input:
+            DF,
+            optional: column or list of columns which define the groups,
+            optional: list of variables (default: numeric columns),
+            optional: maximum number of (padded) rows per batch
+        Output:
+            numpy array (group x variable x variable) of correlations,
+            Pandas Index with the group labels,
+            list of the variables
+    '''
+    if columns is None:
+        columns = df.select_dtypes(['number', 'bool']).columns.drop(
+            by, errors='ignore').to_list()
+    grouped = df.groupby(by, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    groups = grouped.size().index
+    numGroups, p = len(groups), len(columns)
+
+    # Sort rows by group, rows with missing group key are dropped
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    codes = codes[order]
+    values = df[columns].to_numpy(dtype=float)[order]
+    sizes = np.bincount(codes, minlength=numGroups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    groupMean = pd.DataFrame(values).groupby(codes).mean() \
+        .reindex(range(numGroups)).to_numpy()
+
+    # Groups of similar size (same power of two) share one padded batch
+    n = np.zeros((numGroups, p, p))
+    sums = np.zeros((numGroups, p, p))
+    squares = np.zeros((numGroups, p, p))
+    products = np.zeros((numGroups, p, p))
+    bucket = np.ceil(np.log2(np.maximum(sizes, 1))).astype(int)
+    for b in np.unique(bucket[sizes > 0]):
+        members = np.flatnonzero((bucket == b) & (sizes > 0))
+        length = sizes[members].max()
+        perBatch = max(1, batchRows // length)
+        for first in range(0, len(members), perBatch):
+            batch = members[first:first + perBatch]
+            offset = np.arange(length)
+            inside = offset < sizes[batch][:, None]
+            rows = np.where(inside, starts[batch][:, None] + offset, 0)
+            xb = values[rows] - groupMean[batch][:, None, :]
+            vb = inside[..., None] & ~np.isnan(xb)
+            xb[~vb] = 0.0
+            vb = vb.astype(float)
+            # [x, x^2, v]^T @ [x, v] gives all sums and products at once
+            left = np.concatenate([xb, xb * xb, vb], axis=2)
+            right = np.concatenate([xb, vb], axis=2)
+            block = np.matmul(left.transpose(0, 2, 1), right)
+            products[batch] = block[:, :p, :p]
+            sums[batch] = block[:, :p, p:]
+            squares[batch] = block[:, p:2 * p, p:]
+            n[batch] = block[:, 2 * p:, p:]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m2 = squares - sums ** 2 / n
+        cross = products - sums * sums.transpose(0, 2, 1) / n
+        r = cross / np.sqrt(m2 * m2.transpose(0, 2, 1))
+    r[(n < 2) | ~np.isfinite(r)] = np.nan
+    diagonal = np.arange(p)
+    r[:, diagonal, diagonal] = np.where(np.isnan(r[:, diagonal, diagonal]),
+                                        np.nan, 1.0)
+    return np.clip(r, -1, 1), groups, columns
+
+
+def rank_groups_by_correlation(matrices, groups, pooled):
+    '''
+        Aim:
+            Rank groups by how much their correlation matrix differs from
+            the pooled matrix, e.g. to find vehicles with abnormal sensors.
+            The distance is the root mean square difference over all pairs
+            of the lower triangle which are defined in both matrices.
+        Input:
+            matrices, groups -- as returned by grouped_correlation,
+            pooled {DataFrame or array} -- matrix of all data in the same
+                order of variables, e.g. CorrelationAccumulator.correlation()
+        Output:
+            Pandas DF with columns 'group', 'distance' and 'pairs' (number
+            of compared pairs), sorted by distance
+    '''
+    pooled = np.asarray(pooled, dtype=float)
+    row, col = np.tril_indices(pooled.shape[0], k=-1)
+    difference = matrices[:, row, col] - pooled[row, col]
+    defined = ~np.isnan(difference)
+    pairs = defined.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        distance = np.sqrt(np.where(defined, difference ** 2, 0.0).sum(axis=1) / pairs)
+    ranking = pd.DataFrame({'group': groups, 'distance': distance,
+                            'pairs': pairs})
+    return ranking.sort_values(by='distance', ascending=False) \
+        .reset_index(drop=True)
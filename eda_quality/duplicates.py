@@ -0,0 +1,128 @@
+import pandas as pd
+import numpy as np
+
+import shapely
+
+
+# Columns which identify a measurement of the enviroCar API
+DUPLICATE_COLUMNS = ['geometry', 'Engine Load.value', 'Calculated MAF.value',
+                     'Speed.value', 'CO2.value', 'Intake Pressure.value', 'Rpm.value',
+                     'Intake Temperature.value', 'Consumption (GPS-based).value',
+                     'GPS Altitude.value', 'Throttle Position.value', 'GPS Bearing.value',
+                     'Consumption.value', 'GPS Accuracy.value',
+                     'CO2 Emission (GPS-based).value', 'GPS Speed.value',
+                     'track.length', 'track.begin', 'track.end', 'sensor.type',
+                     'sensor.engineDisplacement', 'sensor.model', 'sensor.id',
+                     'sensor.fuelType', 'sensor.constructionYear', 'sensor.manufacturer']
+
+
+def row_fingerprints(df, subset=None):
+    '''
+        Aim:
+            Hash every row once into a uint64 fingerprint. Point geometries
+            are hashed by their coordinates (x, y and z if any point has a
+            z), other geometries by their WKB, all other columns by
+            pandas.util.hash_pandas_object. Equal rows get equal
+            fingerprints, for different rows a collision is possible but
+            unlikely (about 1e-4 for 50M rows).
+        Input:
+            DF,
+            optional: list of columns to compare (default: DUPLICATE_COLUMNS)
+        Output:
+            numpy array of uint64, one fingerprint per row
+    '''
+    if subset is None:
+        subset = DUPLICATE_COLUMNS
+    columns = {}
+    for column in subset:
+        values = df[column]
+        if values.dtype.name != 'geometry':
+            columns[column] = values
+        elif (shapely.get_type_id(values.values) == 0).all():
+            columns[column + '.x'] = shapely.get_x(values.values)
+            columns[column + '.y'] = shapely.get_y(values.values)
+            if shapely.has_z(values.values).any():
+                columns[column + '.z'] = shapely.get_z(values.values)
+        else:
+            columns[column] = shapely.to_wkb(values.values)
+    return pd.util.hash_pandas_object(pd.DataFrame(columns, index=df.index),
+                                      index=False).to_numpy()
+
+
+class FingerprintSet:
+    '''
+        Aim:
+            Fingerprints of all rows ingested so far. Kept as sorted array
+            which can be saved and loaded again, so that rows of a new
+            batch can be checked against an archive without reloading it.
+
+        Input:
+            fingerprints {array} -- optional, initial fingerprints
+    '''
+
+    def __init__(self, fingerprints=None):
+        if fingerprints is None:
+            fingerprints = []
+        self.fingerprints = np.unique(np.asarray(fingerprints, dtype=np.uint64))
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __repr__(self):
+        return 'FingerprintSet({} fingerprints)'.format(len(self))
+
+    def contains(self, fingerprints):
+        '''
+            Boolean array, True for fingerprints which are in the set
+        '''
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        if len(self.fingerprints) == 0:
+            return np.zeros(len(fingerprints), dtype=bool)
+        position = np.searchsorted(self.fingerprints, fingerprints)
+        position[position == len(self.fingerprints)] = 0
+        return self.fingerprints[position] == fingerprints
+
+    def add(self, fingerprints):
+        '''
+            Add fingerprints to the set
+        '''
+        self.fingerprints = np.union1d(
+            self.fingerprints, np.asarray(fingerprints, dtype=np.uint64))
+        return self
+
+    def save(self, path):
+        '''
+            Save the set in .npy format to exactly 'path'
+        '''
+        with open(path, 'wb') as file:
+            np.save(file, self.fingerprints)
+
+    @classmethod
+    def load(cls, path):
+        '''
+            Load a set saved with FingerprintSet.save
+        '''
+        fingerprints = cls()
+        fingerprints.fingerprints = np.load(path)
+        return fingerprints
+
+
+def duplicated_rows(df, subset=None, keep='last', seen=None):
+    '''
+        Aim:
+            Find duplicated rows by their fingerprint
+        Input:
+            DF,
+            optional: list of columns to compare (default: DUPLICATE_COLUMNS),
+            optional: 'keep' as in pandas.DataFrame.duplicated,
+            optional: FingerprintSet 'seen', rows which are in the set count
+                as duplicates as well
+        Output:
+            Boolean array, True for duplicated rows,
+            numpy array with the fingerprint of every row
+    '''
+    fingerprints = row_fingerprints(df, subset)
+    duplicated = pd.Series(fingerprints).duplicated(keep=keep).to_numpy()
+    if seen is not None:
+        duplicated = duplicated | seen.contains(fingerprints)
+    return duplicated, fingerprints
@@ -0,0 +1,203 @@
+import pandas as pd
+import numpy as np
+
+
+FLAG_COLUMN = 'quality_flags'
+
+
+class FlagRegistry:
+    '''
+        Aim:
+            Store quality flags as single bits of one unsigned integer
+            column instead of one int64 column per flag. The registry maps
+            every flag name to its bit, new names are registered on first
+            use. Keep the registry (or its 'names') to decode the column
+            later on. Families of flags, e.g. one outlier flag per
+            variable, get a registry and column of their own (see family),
+            so that they do not use up the bits of the row flags.
+
+        Input:
+            names {list} -- flag names in bit order, bit 0 first
+            column {str} -- name of the column which holds the bits
+            width {int} -- 32 or 64, number of available bits
+    '''
+
+    def __init__(self, names=None, column=FLAG_COLUMN, width=64):
+        if width not in (32, 64):
+            raise ValueError('width has to be 32 or 64, got {}'.format(width))
+        self.column = column
+        self.width = width
+        self.dtype = np.uint32 if width == 32 else np.uint64
+        self.names = []
+        self.families = {}
+        self.register(names or [])
+
+    def __repr__(self):
+        return "FlagRegistry(column='{}', width={}, names={})".format(
+            self.column, self.width, self.names)
+
+    def register(self, names):
+        '''
+            Register new flag names. Nothing is registered if not all of
+            them fit into the free bits.
+        '''
+        new = [name for name in dict.fromkeys(names) if name not in self.names]
+        if len(self.names) + len(new) > self.width:
+            raise ValueError(
+                "No free bits left for {} new flags, {} of {} bits of '{}' "
+                "are in use. Use a family or a second FlagRegistry with "
+                "another column".format(len(new), len(self.names),
+                                        self.width, self.column))
+        self.names.extend(new)
+        return self
+
+    def bit(self, name):
+        '''
+            Bit position of a registered flag, KeyError for unknown names.
+            Flags are registered by register, set and set_many only.
+        '''
+        if name not in self.names:
+            raise KeyError("Unknown flag '{}' in '{}', registered flags are {}"
+                           .format(name, self.column, self.names))
+        return self.names.index(name)
+
+    def family(self, name):
+        '''
+            Registry of the flag family 'name' with its own column
+            '<column>_<name>', created on first use
+        '''
+        if name not in self.families:
+            self.families[name] = FlagRegistry(
+                column='{}_{}'.format(self.column, name), width=self.width)
+        return self.families[name]
+
+    def _bitmask(self, names):
+        # Integer which has the bits of all given flags set
+        if names is None:
+            names = self.names
+        elif isinstance(names, str):
+            names = [names]
+        mask = 0
+        for name in names:
+            mask |= 1 << self.bit(name)
+        return self.dtype(mask)
+
+    def _values(self, df):
+        if self.column in df.columns:
+            return df[self.column].to_numpy().astype(self.dtype, copy=True)
+        return np.zeros(len(df), dtype=self.dtype)
+
+    def set(self, df, name, mask):
+        '''
+            Aim:
+                Set the bit of flag 'name' for all rows where mask is True.
+                Bits which are already set stay set.
+            Input:
+                DF, flag name, boolean array or Series aligned to the DF
+            Output:
+                DF with updated flag column (changed in place)
+        '''
+        return self.set_many(df, [name], np.asarray(mask, dtype=bool)[:, None])
+
+    def set_many(self, df, names, masks):
+        '''
+            Aim:
+                Set several flags at once, one column of 'masks' per name
+            Input:
+                DF, list of flag names, boolean matrix (rows x names)
+            Output:
+                DF with updated flag column (changed in place)
+        '''
+        masks = np.asarray(masks, dtype=bool)
+        values = self._values(df)
+        self.register(names)
+        bits = [self.bit(name) for name in names]
+        if bits and bits == list(range(bits[0], bits[0] + len(bits))):
+            # Consecutive bits: pack every row of the matrix into one integer
+            packed = np.zeros((len(masks), 8), dtype=np.uint8)
+            packed[:, :(len(bits) + 7) // 8] = np.packbits(
+                masks, axis=1, bitorder='little')
+            values |= (packed.view('<u8').ravel() <<
+                       np.uint64(bits[0])).astype(self.dtype)
+        else:
+            for bit, mask in zip(bits, masks.T):
+                values |= mask.astype(self.dtype) << self.dtype(bit)
+        df[self.column] = values
+        return df
+
+    def clear(self, df, names=None):
+        '''
+            Reset the bits of the given flags (default: all flags)
+        '''
+        if self.column in df.columns:
+            df[self.column] = self._values(df) & ~self._bitmask(names)
+        return df
+
+    def test(self, df, names=None):
+        '''
+            Aim:
+                Check which rows carry a flag
+            Input:
+                DF, flag name or list of names (default: all flags)
+            Output:
+                Boolean Series, True if any of the given flags is set
+        '''
+        return pd.Series((self._values(df) & self._bitmask(names)) != 0,
+                         index=df.index)
+
+    def count(self, df, names=None):
+        '''
+            Aim:
+                Number of rows per flag. The bits are only decoded for the
+                distinct values of the flag column, which are few compared
+                to the number of rows.
+            Input:
+                DF, optional list of flag names (default: all flags)
+            Output:
+                Pandas Series with the count per flag name
+        '''
+        if names is None:
+            names = list(self.names)
+        counts = pd.Series(self._values(df)).value_counts()
+        distinct = counts.index.to_numpy().astype(self.dtype)
+        return pd.Series(
+            [int(counts.to_numpy()[(distinct & self._bitmask(name)) != 0].sum())
+             for name in names],
+            index=names, dtype='int64')
+
+    def decode(self, df, names=None, dtype=bool):
+        '''
+            Aim:
+                View of the flag column as one named column per flag
+            Input:
+                DF, optional list of flag names (default: all flags),
+                optional dtype, e.g. int for 0/1 columns
+            Output:
+                Pandas DF with one column per flag aligned to the input
+        '''
+        if names is None:
+            names = list(self.names)
+        values = self._values(df)
+        decoded = {name: ((values & self._bitmask(name)) != 0).astype(dtype)
+                   for name in names}
+        return pd.DataFrame(decoded, index=df.index, columns=names)
+
+
+# Row flags written by the functions in correction.py, the per-variable
+# flags are stored in families named after the row flag
+QUALITY_FLAG_NAMES = ['track_exceeds_8h',
+                      'track_below_5min',
+                      'speedExceeds250km_h',
+                      'implausible_neg_value',
+                      'faulty_percentages',
+                      'outlier_in_sample',
+                      'outlier_in_track_all']
+
+
+def quality_flags(column=FLAG_COLUMN, width=64):
+    '''
+        New FlagRegistry with the row flags of correction.py registered.
+        Use one registry per dataset, the registry keeps the names of all
+        flags which were set with it.
+    '''
+    return FlagRegistry(QUALITY_FLAG_NAMES, column, width)
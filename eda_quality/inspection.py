@@ -1,20 +1,30 @@
 import pandas as pd
-import seaborn as sns
 import numpy as np 
-import matplotlib.pyplot as plt
-import plotly.express as px
 import geopandas as gpd
-from scipy import stats
 
-from shapely.geometry import Polygon, MultiPoint
+import shapely
 import json
-from sklearn.cluster import DBSCAN
-from geopy.distance import great_circle
-from branca.colormap import linear
-import folium
-import datetime
+import os
+import hashlib
 from math import floor, ceil
 
+from ._optional import LazyModule
+from .manipulation import add_column_datetime, _epoch_seconds, _haversine
+from .duplicates import duplicated_rows
+from .missing import MissingProfile
+from .correlation import CorrelationAccumulator
+
+# Plotting and clustering dependencies are imported on first use
+sns = LazyModule('seaborn', 'viz')
+plt = LazyModule('matplotlib.pyplot', 'viz')
+px = LazyModule('plotly.express', 'viz')
+folium = LazyModule('folium', 'viz')
+colormap = LazyModule('branca.colormap', 'viz')
+stats = LazyModule('scipy.stats')
+sklearn_cluster = LazyModule('sklearn.cluster', 'cluster')
+sklearn_neighbors = LazyModule('sklearn.neighbors', 'cluster')
+scipy_sparse = LazyModule('scipy.sparse')
+
 
 
 
@@ -31,83 +41,179 @@ def skewness_num_variables(df): # show_skewness_num_variables
 
 
 def missing_values_per_variable(df, percent=100, dropCol=False): # sum_missing_values
-    listCol =[]
-    rowCount = df.shape[0]
-    for column in df:
-        sumColumn = df[column].isna().sum()
-        percentNA = sumColumn/rowCount*100
-        if percentNA <= percent:
-            listCol.append({'column':column ,'missing_values': sumColumn, 'missing_values(%)': percentNA})
-        else: 
-            if dropCol == True:
-                print('Column dropped: ', column, ', missing values(%): ', percentNA )
-                df.drop([column], axis=1, inplace=True)
-    listCol = pd.DataFrame(listCol).sort_values(by='missing_values', ascending=False).reset_index(drop=True)
+    '''
+        Aim:
+            Number and percentage of missing values per variable,
+            optional: drop variables with more than 'percent' % missing values
+
+        Keyword Arguments:
+            df {Geodataframe} -- point input, changed in place if dropCol
+            percent {float} -- only variables with at most 'percent' %
+                missing values are listed
+            dropCol {bool} -- drop the variables which are not listed
+
+        Output: Pandas DF with columns 'column', 'missing_values' and
+            'missing_values(%)', sorted by the number of missing values
+    '''
+    listCol = MissingProfile.from_frame(df, by=None).per_variable()
+    exceeding = listCol['missing_values(%)'] > percent
+    if dropCol == True:
+        for column, percentNA in listCol.loc[exceeding, ['column', 'missing_values(%)']].itertuples(index=False):
+            print('Column dropped: ', column, ', missing values(%): ', percentNA )
+        df.drop(listCol.loc[exceeding, 'column'].to_list(), axis=1, inplace=True)
+    listCol = listCol[~exceeding].sort_values(by='missing_values', ascending=False).reset_index(drop=True)
     return listCol
 
 
 def missing_values_per_track(df):
-    columnList=df.select_dtypes(['float64']).columns.tolist()
-    df_count=df.groupby('track.id').apply(lambda x: x.isna().sum()) 
-    df_prop=df.groupby('track.id').apply(lambda x: x.isna().sum()/len(x)*100)
-    return df_count, df_prop
+    '''
+        Aim:
+            Number and percentage of missing values per track and variable
 
+        Keyword Arguments:
+            df {Geodataframe} -- point input
+
+        Output: Pandas DF with the number of missing values,
+            Pandas DF with the percentage of missing values,
+            both with one row per track and one column per variable.
+            Use MissingProfile for datasets which are processed in chunks.
+    '''
+    profile = MissingProfile.from_frame(df, by='track.id')
+    return profile.counts, profile.proportions()
 
-def get_classified_correlations(df, method):
-    allCoeffs=[]
-    correlationsMatrixAll = df.corr(method=method)
-    for column in correlationsMatrixAll:
-        for i in correlationsMatrixAll[column].index:
-            df = correlationsMatrixAll.at[i, column]
-            if df < 1.0:
-                allCoeffs.append({'column':column, 'index':i, 'coefficient':df })
-
-    correlationsMatrix = correlationsMatrixAll.where(np.tril(np.ones(correlationsMatrixAll.shape)).astype(np.bool))
-
-    very_strong=[]
-    strong=[]
-    moderate=[]
-    weak=[]   
-    for column in correlationsMatrix:
-        for i in correlationsMatrix[column].index:
-            df = correlationsMatrix.at[i, column]
-            if df >= 0.8 and df < 1.0 or df <= -0.8 and df > -1.0:
-                very_strong.append({'column':column, 'index':i, 'coefficient':df })#   
-            if df >= 0.6 and df < 0.8 or df <= -0.6 and df > -0.8:
-                strong.append({'column':column, 'index':i, 'coefficient':df })
-            if df >= 0.4 and df < 0.6 or df <= -0.4 and df > -0.6:
-                moderate.append({'column':column, 'index':i, 'coefficient':df })
-            if df < 0.4 and df > -0.4:
-                weak.append({'column':column, 'index':i, 'coefficient':df })
-
-    very_strong = pd.DataFrame(very_strong).sort_values(by='coefficient', ascending=False).reset_index(drop=True)
-    strong = pd.DataFrame(strong).sort_values(by='coefficient', ascending=False).reset_index(drop=True)
-    moderate = pd.DataFrame(moderate).sort_values(by='coefficient', ascending=False).reset_index(drop=True)
-    weak=pd.DataFrame(weak).sort_values(by='coefficient', ascending=False).reset_index(drop=True)
-    allCoeffs= pd.DataFrame(allCoeffs).sort_values(by='coefficient', ascending=False).reset_index(drop=True)
 
+# Upper bounds of |r| for weak, moderate, strong and very strong correlations
+CORRELATION_BINS = [0.4, 0.6, 0.8, 1.0]
+
+
+def get_classified_correlations(df, method):
+    '''
+        Aim:
+            Classify the correlations of all pairs of numeric variables by
+            their strength. The lower triangle of the correlation matrix is
+            stacked and binned by the absolute coefficient in one step.
+
+        Keyword Arguments:
+            df {Geodataframe} -- point input, or a CorrelationAccumulator
+                filled chunk by chunk for data which does not fit in memory
+            method {str} -- 'pearson', 'kendall' or 'spearman', ignored for
+                a CorrelationAccumulator
+
+        Output: Pandas DFs with columns 'column', 'index' and 'coefficient':
+            all coefficients < 1, very strong (|r| >= 0.8), strong
+            (|r| >= 0.6), moderate (|r| >= 0.4) and weak correlations,
+            each sorted by the coefficient
+    '''
+    correlationsMatrixAll = _correlation_matrix(df, method)
+    columns = correlationsMatrixAll.columns.to_numpy()
+    matrix = correlationsMatrixAll.to_numpy()
+
+    # All cells, column by column, without NaN and coefficients >= 1
+    allCoeffs = _stacked_coefficients(columns, matrix.T)
+    allCoeffs = allCoeffs[allCoeffs['coefficient'] < 1.0]
+
+    # Lower triangle column by column, classified by the absolute value
+    col, row = np.triu_indices(len(columns))
+    lower = _stacked_coefficients(columns, matrix.T, col, row)
+    strength = np.digitize(lower['coefficient'].abs(), CORRELATION_BINS)
+    weak, moderate, strong, very_strong = [
+        _sorted_coefficients(lower[strength == i]) for i in range(4)]
+
+    allCoeffs = _sorted_coefficients(allCoeffs)
     return allCoeffs, very_strong, strong, moderate, weak 
 
 
+def _correlation_matrix(df, method):
+    if isinstance(df, CorrelationAccumulator):
+        return df.correlation()
+    return df.corr(method=method, numeric_only=True)
+
+
+def _stacked_coefficients(columns, matrixT, col=None, row=None):
+    # One row per cell (column, index) of the transposed matrix, NaN dropped
+    if col is None:
+        col, row = np.indices(matrixT.shape).reshape(2, -1)
+    stacked = pd.DataFrame({'column': columns[col], 'index': columns[row],
+                            'coefficient': matrixT[col, row]})
+    return stacked[stacked['coefficient'].notna()]
+
+
+def _sorted_coefficients(coefficients):
+    return coefficients.sort_values(by='coefficient', ascending=False).reset_index(drop=True)
+
+
+# Memoized coefficients, {(data fingerprint, method): {(v1, v2): r}}
+_correlationCache = {}
+_CORRELATION_CACHE_SIZE = 32
+
+
+def _data_fingerprint(df):
+    # Order sensitive hash of the values of all rows
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.blake2b(rows.tobytes(), digest_size=16).hexdigest()
+
+
+def get_correlations(df, method, pairs):
+    '''
+        Aim:
+            Correlation coefficients of selected pairs of variables. Only
+            the requested pairs are computed, the results are memoized per
+            (fingerprint of the data, method), so repeated requests on the
+            same data do not compute a pair twice.
+
+        Keyword Arguments:
+            df {Geodataframe} -- point input
+            method {str} -- 'pearson', 'kendall' or 'spearman'
+            pairs {list} -- list of tuples (variable1, variable2)
+
+        Output: Pandas DF with columns 'v1', 'v2' and 'coefficient',
+            one row per pair
+    '''
+    pairs = [tuple(pair) for pair in pairs]
+    variables = list(dict.fromkeys(variable for pair in pairs for variable in pair))
+    key = (_data_fingerprint(df[variables]), method)
+    if key not in _correlationCache:
+        if len(_correlationCache) >= _CORRELATION_CACHE_SIZE:
+            _correlationCache.pop(next(iter(_correlationCache)))
+        _correlationCache[key] = {}
+    coefficients = _correlationCache[key]
+
+    for variable1, variable2 in pairs:
+        if (variable1, variable2) not in coefficients:
+            # Same routine as the full matrix, but for a 2 x 2 matrix
+            coefficient = df[[variable1, variable2]].corr(method=method).iat[0, 1]
+            coefficients[(variable1, variable2)] = coefficient
+            coefficients[(variable2, variable1)] = coefficient
+    return pd.DataFrame({'v1': [pair[0] for pair in pairs],
+                         'v2': [pair[1] for pair in pairs],
+                         'coefficient': [coefficients[pair] for pair in pairs]})
+
+
 def get_correlation(df, method, variable1, variable2):
-    allCoeffs=[]
-    correlationsMatrixAll = df.corr(method=method)
-    for column in correlationsMatrixAll:
-        for i in correlationsMatrixAll[column].index:
-            df = correlationsMatrixAll.at[i, column]
-            if df < 1.0:
-                allCoeffs.append({'v1':column, 'v2':i, 'coefficient':df })
-
-    correlationsMatrix = correlationsMatrixAll.where(np.tril(np.ones(correlationsMatrixAll.shape)).astype(np.bool))
-    allCoeffs= pd.DataFrame(allCoeffs).sort_values(by='coefficient', ascending=False).reset_index(drop=True)
-    showCorr= allCoeffs.loc[(allCoeffs['v1'] == variable1) & (allCoeffs['v2'] == variable2)]
-    return showCorr
+    '''
+        Aim:
+            Correlation coefficient of two variables, only this pair is
+            computed
+
+        Keyword Arguments:
+            df {Geodataframe} -- point input
+            method {str} -- 'pearson', 'kendall' or 'spearman'
+            variable1, variable2 {str} -- names of the variables
+
+        Output: Pandas DF with columns 'v1', 'v2' and 'coefficient', empty
+            if the coefficient is NaN or 1
+    '''
+    showCorr = get_correlations(df, method, [(variable1, variable2)])
+    return showCorr[showCorr['coefficient'] < 1.0]
     
     
 def correlation_heatmap_triangle(df, method, figsize=(20, 16)):
-    df = df.select_dtypes(['float64'])
-    coefficient = df.corr(method=method)
-    coefficient = coefficient.where(np.tril(np.ones(coefficient.shape)).astype(np.bool))
+    if isinstance(df, CorrelationAccumulator):
+        coefficient = df.correlation()
+    else:
+        df = df.select_dtypes(['float64'])
+        coefficient = df.corr(method=method)
+    coefficient = coefficient.where(np.tril(np.ones(coefficient.shape)).astype(bool))
     plt.figure(figsize=figsize)
     sns.heatmap(coefficient, annot = True, vmin=-1, vmax=1.0, cmap="RdBu_r")
 
@@ -118,17 +224,22 @@ def get_single_track(df, track_id):
     return df
 
 
-def show_dublicated_tracks(df):   
-    dublicates = df[df[['geometry', 'Engine Load.value', 'Calculated MAF.value',
-    'Speed.value', 'CO2.value', 'Intake Pressure.value', 'Rpm.value',
-    'Intake Temperature.value', 'Consumption (GPS-based).value',
-    'GPS Altitude.value', 'Throttle Position.value', 'GPS Bearing.value',
-    'Consumption.value', 'GPS Accuracy.value',
-    'CO2 Emission (GPS-based).value', 'GPS Speed.value', 
-    'track.length', 'track.begin', 'track.end', 'sensor.type',
-    'sensor.engineDisplacement', 'sensor.model', 'sensor.id',
-    'sensor.fuelType', 'sensor.constructionYear', 'sensor.manufacturer']].
-     duplicated(keep=False)==True]['track.id'].unique().tolist()
+def show_dublicated_tracks(df, subset=None, seen=None):
+    '''
+        Aim:
+            Show tracks which contain duplicated rows, rows are compared by
+            a uint64 fingerprint of the columns in 'subset'
+
+        Keyword Arguments:
+            df {Geodataframe} -- point input
+            subset {list} -- optional, columns to compare (default: DUPLICATE_COLUMNS)
+            seen {FingerprintSet} -- optional, rows which are in the set
+                count as duplicates as well
+
+        Output: Geodataframe with all points of the tracks
+    '''
+    duplicated, fingerprints = duplicated_rows(df, subset, keep=False, seen=seen)
+    dublicates = df['track.id'][duplicated].unique().tolist()
 
     newdf= df.copy().loc[df['track.id'].isin(dublicates)]
     ls= newdf['track.id'].unique().tolist()
@@ -207,7 +318,7 @@ def plot_tracks(points_df, column):
 
     """
     # Add datetime to data frame
-    points_df['datetime'] = pd.to_datetime(points_df['time'])
+    add_column_datetime(points_df)
     points_df['index']=points_df.index
     fig = px.line(points_df, x="index", y=column, color="track.id",
                   line_group="track.id", hover_name="datetime")
@@ -316,18 +427,10 @@ def st_cube_simple(points):
         No Return
     """
 
-    def seconds_from_start(x, start):
-        date_time_obj = datetime.datetime.strptime(x, '%Y-%m-%dT%H:%M:%S')
-        seconds = (date_time_obj-start).total_seconds()
-        return int(seconds)
-
     points['lat'] = points['geometry'].apply(lambda coord: coord.y)
     points['lng'] = points['geometry'].apply(lambda coord: coord.x)
-    start_time = datetime.datetime.strptime(
-        points.time.iloc[0], '%Y-%m-%dT%H:%M:%S')
-
-    points['time_seconds'] = np.vectorize(seconds_from_start)(
-        np.array(points.time.values.tolist()), start_time)
+    seconds = _epoch_seconds(points)
+    points['time_seconds'] = (seconds - seconds[0]).astype(int)
 
     # plot the space-time cube
     fig = plt.figure()
@@ -504,12 +607,58 @@ def extract_barplot_info(day_length):
     return day, height, highest, highest_index, average
 
 
+def _assign_grid_cells(df, gridSize):
+    """
+    Maps every point to a cell of a regular grid by floor division of its
+        projected coordinates. The grid itself is never built.
+
+    Parameters
+    ----------
+    df : geopandas dataframe
+        Points in a projected crs.
+    gridSize : float
+        the size of grid on same unit as geodataframe coordinates.
+
+    Returns
+    -------
+    cellId : numpy array
+        Grid id of each point. Ids are numbered column by column, starting
+        in the top left corner of the bounding box.
+    origin : tuple
+        (left, top, rows) of the grid, needed to rebuild cell geometries.
+
+    """
+    x = df.geometry.x.to_numpy()
+    y = df.geometry.y.to_numpy()
+    left = floor(np.nanmin(x) / gridSize) * gridSize
+    top = ceil(np.nanmax(y) / gridSize) * gridSize
+    bottom = floor(np.nanmin(y) / gridSize) * gridSize
+    rows = int((top - bottom) / gridSize)+1
+
+    col = np.floor((x - left) / gridSize).astype(np.int64)
+    row = np.floor((top - y) / gridSize).astype(np.int64)
+    return col * rows + row, (left, top, rows)
+
+
+def _grid_cell_bounds(cellId, origin, gridSize):
+    """
+    Returns xmin, ymin, xmax, ymax arrays of the given grid cells.
+    """
+    left, top, rows = origin
+    col, row = np.divmod(np.asarray(cellId, dtype=np.int64), rows)
+    xmin = left + col * gridSize
+    ymax = top - row * gridSize
+    return xmin, ymax - gridSize, xmin + gridSize, ymax
+
+
 def spatioTemporalAggregation(df, field, summary, gridSize):
     """
     Aggregates the given field on hour and weekday basis.
     Prepares data for mosaic plot
-    FOR THIS TO WORK YOU NEED TO INSTALL RTree or Rtree-linux!!!
-    # TODO This function is poorly performing
+    Points are assigned to grid cells by integer arithmetic on the projected
+    coordinates and aggregated in a single groupby on gridId, weekday and hour.
+    Geometries are only created for occupied cells and for the subgrids
+    which hold a value.
     Parameters
     ----------
     df : geopandas dataframe
@@ -527,135 +676,90 @@ def spatioTemporalAggregation(df, field, summary, gridSize):
         Aggregated grids with summary on it
 
     """
-    def round_down(num, divisor):
-        return floor(num / divisor) * divisor
-
-    def round_up(num, divisor):
-        return ceil(num / divisor) * divisor
-
     # Get crs from data
     sourceCRS = df.crs
     targetCRS = "epsg:3857"
-    # Reproject to Mercator\
+    # Parse timestamps once on the source frame, then reproject to Mercator
+    timestamps = add_column_datetime(df)['datetime']
     df = df.to_crs(targetCRS)
 
-    # Get bounds
-    xmin, ymin, xmax, ymax = df.total_bounds
-    height, width = gridSize, gridSize
-    top, left = round_up(ymax, height), round_down(xmin, width)
-    bottom, right = round_down(ymin, height), round_up(xmax, width)
-
-    rows = int((top - bottom) / height)+1
-    cols = int((right - left) / width)+1
-
-    XleftOrigin = left
-    XrightOrigin = left + width
-    YtopOrigin = top
-    YbottomOrigin = top - height
-    polygons = []
-
-    for i in range(cols):
-        Ytop = YtopOrigin
-        Ybottom = YbottomOrigin
-        for j in range(rows):
-            polygons.append(Polygon(
-                [(XleftOrigin, Ytop), (XrightOrigin, Ytop),
-                 (XrightOrigin, Ybottom), (XleftOrigin, Ybottom)]))
-            Ytop = Ytop - height
-            Ybottom = Ybottom - height
-        XleftOrigin = XleftOrigin + width
-        XrightOrigin = XrightOrigin + width
-
-    grid = gpd.GeoDataFrame({'geometry': polygons})
-    grid.crs = (targetCRS)
-
-    # Assign gridid
-    numGrid = len(grid)
-    grid['gridId'] = list(range(numGrid))
-
     # Identify gridId for each point
-
-    df['hour'] = df['time'].apply(
-        lambda x: datetime.datetime.strptime(
-            x, '%Y-%m-%dT%H:%M:%S+00:00')).dt.hour
-    df['weekday'] = df['time'].apply(
-        lambda x: datetime.datetime.strptime(
-            x, '%Y-%m-%dT%H:%M:%S+00:00')).dt.dayofweek
-
-    # df['hour'] = pd.to_datetime(df['time']).dt.hour
-    # df['weekday'] = pd.to_datetime(df['time']).dt.dayofweek
-
-    points_identified = gpd.sjoin(df, grid, op='within')
-
-    # group points by gridid and calculate mean Easting,
-    # store it as dataframe
-    # delete if field already exists
-    if field in grid.columns:
-        del grid[field]
+    cellId, origin = _assign_grid_cells(df, gridSize)
+    points_identified = pd.DataFrame({
+        'gridId': cellId,
+        'weekday': timestamps.dt.dayofweek.to_numpy(),
+        'hour': timestamps.dt.hour.to_numpy(),
+        field: df[field].to_numpy()})
 
     # Aggregate by weekday, hour and grid
     grouped = points_identified.groupby(
-        ['gridId', 'weekday', 'hour']).agg({field: [summary]})
-    grouped = grouped.reset_index()
-    grouped.columns = grouped.columns.map("_".join)
+        ['gridId', 'weekday', 'hour'])[field].agg(summary)
     modified_fieldname = field+"_"+summary
-
-    # Create Subgrids
-    subgrid, mainGrid, rowNum, columnNum, value = [], [], [], [], []
-    unikGrid = grouped['gridId_'].unique()
-    print('running; wait till you see "finished"')
-    for currentGrid in unikGrid:
-        dataframe = grid[grid['gridId'] == currentGrid]
-        xmin, ymin, xmax, ymax = dataframe.total_bounds
-        xminn, xmaxx, yminn, ymaxx = xmin + \
-            (xmax-xmin)*0.05, xmax-(xmax-xmin)*0.05, ymin + \
-            (ymax-ymin)*0.05, ymax-(ymax-ymin)*0.05
-        rowOffset = (ymaxx-yminn)/24.0
-        colOffset = (xmaxx - xminn)/7.0
-        tmp = (grouped['gridId_'] == currentGrid)
-        for i in range(7):
-            tmp2=(grouped['weekday_'] == i)
-            for j in range(24):
-                topy, bottomy, leftx, rightx = ymaxx-j*rowOffset, ymaxx - \
-                    (j+1)*rowOffset, xminn+i * \
-                    colOffset, xminn+(i+1)*colOffset
-                subgrid.append(
-                    Polygon([(leftx, topy), (rightx, topy),
-                             (rightx, bottomy), (leftx, bottomy)]))
-                mainGrid.append(currentGrid)
-                rowNum.append(j)
-                columnNum.append(i)
-                if len(grouped[tmp
-                       & tmp2
-                       & (grouped['hour_'] == j)]) != 0:
-                    this_value = grouped[
-                        tmp
-                        & tmp2
-                        & (grouped['hour_'] == j)].iloc[0][
-                            modified_fieldname]
-                    value.append(this_value)
-                else:
-                    value.append(np.nan)
-    subgrid_gpd = gpd.GeoDataFrame({'geometry': subgrid})
-    subgrid_gpd.crs = targetCRS
-    # Reproject to Mercator\
+    grouped = grouped.rename(modified_fieldname).reset_index()
+    # Main grid cells hold points, even if all their values are missing
+    unikGrid = np.unique(grouped['gridId'].to_numpy())
+    grouped = grouped.dropna().reset_index(drop=True)
+
+    # Create Subgrids, only for weekday and hour combinations with data
+    xmin, ymin, xmax, ymax = _grid_cell_bounds(
+        grouped['gridId'].to_numpy(), origin, gridSize)
+    xminn, ymaxx = xmin + (xmax-xmin)*0.05, ymax-(ymax-ymin)*0.05
+    rowOffset = (ymax-ymin)*0.9/24.0
+    colOffset = (xmax-xmin)*0.9/7.0
+    weekday = grouped['weekday'].to_numpy()
+    hour = grouped['hour'].to_numpy()
+    subgrid = shapely.box(xminn + weekday*colOffset,
+                          ymaxx - (hour+1)*rowOffset,
+                          xminn + (weekday+1)*colOffset,
+                          ymaxx - hour*rowOffset)
+
+    subgrid_gpd = gpd.GeoDataFrame({'geometry': subgrid}, crs=targetCRS)
+    # Reproject to source crs
     subgrid_gpd = subgrid_gpd.to_crs(sourceCRS)
-    subgrid_gpd['gridId'] = mainGrid
-    subgrid_gpd['Weekday'] = columnNum
-    subgrid_gpd['hour'] = rowNum
-    subgrid_gpd['gridId'] = subgrid_gpd.apply(lambda x: str(
-        x['gridId'])+"_"+str(x['Weekday'])+"_"+str(x['hour']), axis=1)
-    subgrid_gpd[modified_fieldname] = value
-    subgrid_gpd = subgrid_gpd.dropna()
+    subgrid_gpd['gridId'] = (grouped['gridId'].astype(str) + "_"
+                             + grouped['weekday'].astype(str) + "_"
+                             + grouped['hour'].astype(str))
+    subgrid_gpd['Weekday'] = weekday
+    subgrid_gpd['hour'] = hour
+    subgrid_gpd[modified_fieldname] = grouped[modified_fieldname]
+
+    # Create main grid cells which hold at least one point
+    grid = gpd.GeoDataFrame(
+        {'geometry': shapely.box(*_grid_cell_bounds(unikGrid, origin,
+                                                    gridSize)),
+         'gridId': unikGrid}, index=unikGrid, crs=targetCRS)
     grid = grid.to_crs(sourceCRS)
-    grid = grid[grid['gridId'].isin(unikGrid)]
-    print('finished')
     return grid, subgrid_gpd
-    # final_subgrid=subgrid_gpd[subgrid_gpd['value'].notnull()]
-    # return final_subgrid
+
 
 #############################################################################################################################
-def MosaicPlot(mainGrid, grid, field):
+def _grid_geojson(grid, properties, fillColors=None):
+    # GeoJSON dict of the grid with the given properties only, built in
+    # memory. All geometries are converted by shapely at once and parsed in
+    # one go. fillColors are added as property 'fillColor' per feature.
+    geometries = json.loads(
+        '[' + ','.join(shapely.to_geojson(grid.geometry.values)) + ']')
+    attributes = grid[properties].astype(object)
+    records = attributes.where(attributes.notna(), None).to_dict('records')
+    if fillColors is not None:
+        for record, color in zip(records, fillColors):
+            record['fillColor'] = color
+    return {'type': 'FeatureCollection',
+            'features': [{'type': 'Feature', 'properties': record,
+                          'geometry': geometry}
+                         for record, geometry in zip(records, geometries)]}
+
+
+def _fill_colors(values, colormap_rn):
+    # Color of every value, the colormap is evaluated once per distinct
+    # value, missing values get no color
+    codes, distinct = pd.factorize(values)
+    colors = np.array([colormap_rn(value) for value in distinct] + [None],
+                      dtype=object)
+    return colors[codes].tolist()
+
+
+def MosaicPlot(mainGrid, grid, field, directory=None):
     """
     Performs spatio temporal aggregation of data on weekday and hour,
         and prepares mosaicplot.
@@ -669,6 +773,10 @@ def MosaicPlot(mainGrid, grid, field):
     only represents an hour of a weekday
     field : string
         Fieldname with aggregated data
+    directory : string, optional
+        If given, mainGrids.geojson, grids.geojson and attributes.csv are
+        written to this directory. The map itself is built in memory.
+        The default is None.
 
     Returns
     -------
@@ -676,26 +784,30 @@ def MosaicPlot(mainGrid, grid, field):
         Folium map with openstreetmap as base.
 
     """
-    # Prepare for grid plotting using folium
-    grid.columns = [cols.replace('.', '_') for cols in grid.columns]
+    # Prepare for grid plotting using folium, on a copy of the grid
+    grid = grid.rename(columns=lambda cols: cols.replace('.', '_'))
     field = field.replace('.', '_')
     # Convert grid id to string
     grid['gridId'] = grid['gridId'].astype(str)
 
-    # Convert maingrid,subgrid to geojson and csv
-    mainGrid.to_file("mainGrids.geojson", driver='GeoJSON')
-    atts = pd.DataFrame(grid)
-    grid.to_file("grids.geojson", driver='GeoJSON')
-    atts.to_csv("attributes.csv", index=False)
+    # Optionally save maingrid,subgrid as geojson and csv
+    if directory is not None:
+        mainGrid.to_file(os.path.join(directory, "mainGrids.geojson"),
+                         driver='GeoJSON')
+        grid.to_file(os.path.join(directory, "grids.geojson"), driver='GeoJSON')
+        pd.DataFrame(grid).to_csv(os.path.join(directory, "attributes.csv"),
+                                  index=False)
 
-    # load spatial and non-spatial data
-    data_geojson_source = "grids.geojson"
-    # data_geojson=gpd.read_file(data_geojson_source)
-    data_geojson = json.load(open(data_geojson_source))
+    # construct color map
+    minvalue = grid[field].min()
+    maxvalue = grid[field].max()
+    colormap_rn = colormap.linear.YlOrRd_09.scale(minvalue, maxvalue)
 
-    # load spatial and non-spatial data
-    grid_geojson_source = "mainGrids.geojson"
-    mainGrid_geojson = json.load(open(grid_geojson_source))
+    # Build geojson of main grid and subgrids in memory, the color of every
+    # subgrid is stored as its property 'fillColor'
+    mainGrid_geojson = _grid_geojson(mainGrid, [])
+    data_geojson = _grid_geojson(grid, ['gridId', 'Weekday', 'hour', field],
+                                 _fill_colors(grid[field], colormap_rn))
 
     # Get coordiantes for map centre
     lat = grid.geometry.centroid.y.mean()
@@ -706,12 +818,6 @@ def MosaicPlot(mainGrid, grid, field):
                    zoom_start=10, tiles='Stamen Toner')
 
     # Configure geojson layer
-    # style = {'fillColor': '#f5f5f5', 'lineColor': '#ffffbf'}
-    # polygon = folium.GeoJson(gjson, style_function = \
-    # lambda x: style).add_to(m)
-    # def style_function():
-    # return {'fillColor': '#00FFFFFF', 'lineColor': '#00FFFFFF'}
-    # folium.GeoJson(data_geojson).add_to(m)
     folium.GeoJson(mainGrid_geojson,
                    lambda feature: {'lineOpacity': 0.4,
                                     'color': '#00ddbb',
@@ -719,20 +825,6 @@ def MosaicPlot(mainGrid, grid, field):
                                     'weight': 2,
                                     'fillOpacity': 0}).add_to(m)
 
-    # add attribute data
-    attribute_pd = pd.read_csv("attributes.csv")
-    attribute = pd.DataFrame(attribute_pd)
-    # Convert gridId to string to ensure it matches with gridId
-    attribute['gridId'] = attribute['gridId'].astype(str)
-
-    # construct color map
-    minvalue = attribute[field].min()
-    maxvalue = attribute[field].max()
-    colormap_rn = linear.YlOrRd_09.scale(minvalue, maxvalue)
-
-    # Create Dictionary for colormap
-    population_dict_rn = attribute.set_index('gridId')[field]
-
     # create map
     folium.GeoJson(
         data_geojson,
@@ -740,8 +832,7 @@ def MosaicPlot(mainGrid, grid, field):
         style_function=lambda feature: {
             'lineOpacity': 0,
             'color': 'green',
-            'fillColor': colormap_rn(population_dict_rn[
-                feature['properties']['gridId']]),
+            'fillColor': feature['properties']['fillColor'],
             'weight': 0,
             'fillOpacity': 0.9
         },
@@ -769,93 +860,66 @@ def aggregateByGrid(df, field, summary, gridSize):
     """
     Aggregates the specified field with chosen summary type and user
         defined grid size. returns aggregated grids with summary
+    Points are mapped to grid cells by floor division of the projected
+    coordinates, so only occupied cells are built and memory grows with
+    the number of occupied cells instead of the bounding box area.
 
     Parameters
     ----------
     df : geopandas dataframe
-    field : string
-        field to be summarized.
-    summary : string
-        type of summary to be sumarized. eg. min, max,sum, median
+    field : string or list of strings
+        field(s) to be summarized.
+    summary : string or list of strings
+        type(s) of summary to be sumarized. eg. min, max,sum, median
     gridSize : float
         the size of grid on same unit as geodataframe coordinates.
 
     Returns
     -------
     geodataframe
-        Aggregated grids with summary on it
+        Aggregated grids with one column summary_field per combination of
+        field and summary. Sorted by the first of these columns.
 
     """
-    def round_down(num, divisor):
-        return floor(num / divisor) * divisor
-
-    def round_up(num, divisor):
-        return ceil(num / divisor) * divisor
+    fields = [field] if isinstance(field, str) else list(field)
+    summaries = [summary] if isinstance(summary, str) else list(summary)
 
     # Get crs from data
     sourceCRS = df.crs
     targetCRS = "EPSG:3857"
     # Reproject to Mercator\
     df = df.to_crs(targetCRS)
-    # Get bounds
-    xmin, ymin, xmax, ymax = df.total_bounds
-    print(xmin, ymin, xmax, ymax)
-    height, width = gridSize, gridSize
-    top, left = round_up(ymax, height), round_down(xmin, width)
-    bottom, right = round_down(ymin, height), round_up(xmax, width)
-
-    rows = int((top - bottom) / height)+1
-    cols = int((right - left) / width)+1
-
-    XleftOrigin = left
-    XrightOrigin = left + width
-    YtopOrigin = top
-    YbottomOrigin = top - height
-    polygons = []
-    for i in range(cols):
-        Ytop = YtopOrigin
-        Ybottom = YbottomOrigin
-        for j in range(rows):
-            polygons.append(Polygon([(XleftOrigin, Ytop),
-                                     (XrightOrigin, Ytop),
-                                     (XrightOrigin, Ybottom),
-                                     (XleftOrigin, Ybottom)]))
-            Ytop = Ytop - height
-            Ybottom = Ybottom - height
-        XleftOrigin = XleftOrigin + width
-        XrightOrigin = XrightOrigin + width
-
-    grid = gpd.GeoDataFrame({'geometry': polygons})
-    grid.crs = df.crs
-
-    # Assign gridid
-    numGrid = len(grid)
-    grid['gridId'] = list(range(numGrid))
 
     # Identify gridId for each point
-    points_identified = gpd.sjoin(df, grid, op='within')
-
-    # group points by gridid and calculate mean Easting,
-    # store it as dataframe
-    # delete if field already exists
-    if field in grid.columns:
-        del grid[field]
-    grouped = points_identified.groupby('gridId')[field].agg(summary)
-    grouped_df = pd.DataFrame(grouped)
-
-    new_grid = grid.join(grouped_df, on='gridId').fillna(0)
-    grid = new_grid.to_crs(sourceCRS)
-    summarized_field = summary+"_"+field
-    final_grid = grid.rename(columns={field: summarized_field})
-    final_grid = final_grid[final_grid[summarized_field] > 0].sort_values(
-        by=summarized_field, ascending=False)
-    final_grid[summarized_field] = round(final_grid[summarized_field], 1)
+    cellId, origin = _assign_grid_cells(df, gridSize)
+    points_identified = pd.DataFrame(
+        {name: df[name].to_numpy() for name in fields})
+    points_identified['gridId'] = cellId
+
+    # Summarize all fields in a single groupby
+    grouped = points_identified.groupby('gridId')[fields].agg(summaries)
+    grouped.columns = [summary+"_"+field for field, summary in grouped.columns]
+    summarized_fields = [summary+"_"+field
+                         for field in fields for summary in summaries]
+    grouped = grouped[summarized_fields]
+    grouped = grouped[(grouped.fillna(0) > 0).any(axis=1)]
+    grouped.index.name = None
+
+    # Create geometries for occupied cells only
+    final_grid = gpd.GeoDataFrame(
+        {'geometry': shapely.box(*_grid_cell_bounds(grouped.index, origin,
+                                                    gridSize)),
+         'gridId': grouped.index}, index=grouped.index, crs=targetCRS)
+    final_grid = final_grid.to_crs(sourceCRS).join(grouped.fillna(0))
+    final_grid = final_grid.sort_values(by=summarized_fields[0],
+                                        ascending=False)
+    final_grid[summarized_fields] = final_grid[summarized_fields].round(1)
+    centroids = final_grid.geometry.centroid
     final_grid['x_centroid'], final_grid['y_centroid'] = \
-        final_grid.geometry.centroid.x, final_grid.geometry.centroid.y
+        centroids.x, centroids.y
     return final_grid
 
 
-
 def aggregateHourly(df, field, summary):
     """
     Aggregates the whole data by weekday and hour as preparation step for
@@ -877,15 +941,9 @@ def aggregateHourly(df, field, summary):
 
     """
     # extract date and time from timestamp
-    df['hour'] = df['time'].apply(
-        lambda x: datetime.datetime.strptime(
-            x, '%Y-%m-%dT%H:%M:%S+00:00')).dt.hour
-    df['weekday'] = df['time'].apply(
-        lambda x: datetime.datetime.strptime(
-            x, '%Y-%m-%dT%H:%M:%S+00:00')).dt.dayofweek
-
-    # df['hour'] = pd.to_datetime(df['time']).dt.hour
-    # df['weekday'] = pd.to_datetime(df['time']).dt.dayofweek
+    timestamps = add_column_datetime(df)['datetime']
+    df['hour'] = timestamps.dt.hour
+    df['weekday'] = timestamps.dt.dayofweek
 
     # Aggregate by weekday and hour
     dayhourAggregate = df.groupby(
@@ -894,38 +952,71 @@ def aggregateHourly(df, field, summary):
     dayhourAggregate.columns = dayhourAggregate.columns.map("_".join)
     return dayhourAggregate
 
-def OriginAndDestination(df):
+def OriginAndDestination(df, pairs=False):
     """
     Return dataframe for origin and destinations for tracks
-        by their trackid
+        by their trackid. The points are sorted once by track and parsed
+        time, the first and last point of every track follow from the
+        track boundaries.
 
     Parameters
     ----------
-    df : TYPE
-        DESCRIPTION.
+    df : GeoDataFrame
+        Track points with 'track.id', 'time' and point geometries.
+    pairs : Boolean, optional
+        Return one origin-destination pair per track in a single frame
+            instead. The default is False.
 
     Returns
     -------
-    origin : TYPE
-        DESCRIPTION.
-    destination : TYPE
-        DESCRIPTION.
+    origin : GeoDataFrame
+        Points at the earliest time of their track (all of them on ties),
+            ordered by track.
+    destination : GeoDataFrame
+        Points at the latest time of their track.
+    or, if pairs is True:
+    od_pairs : DataFrame
+        One row per track with 'track.id', 'origin_time',
+            'destination_time', 'origin_lat', 'origin_lng',
+            'destination_lat', 'destination_lng', 'distance' (great circle
+            distance in m) and 'duration' (s).
 
     """
-    track_list = list(df['track.id'].unique())
-    origin, destination = gpd.GeoDataFrame(), gpd.GeoDataFrame()
-    for track in track_list:
-        selected_tracks = df[df['track.id'] == track]
-        current_origin = selected_tracks[selected_tracks['time']
-                                         == selected_tracks['time'].min()]
-        current_destination = selected_tracks[selected_tracks['time']
-                                              == selected_tracks[
-                                                  'time'].max()]
-        origin = origin.append(current_origin)
-        destination = destination.append(current_destination)
-    return origin, destination
-
-def plotAggregate(grid, field):
+    seconds = _epoch_seconds(df)
+    track, tracks = pd.factorize(df['track.id'])
+    # points without time or track id belong to no origin or destination
+    timed = np.flatnonzero(~np.isnan(seconds) & (track >= 0))
+    order = timed[np.lexsort((seconds[timed], track[timed]))]
+    track_sorted = track[order]
+    first = order[np.diff(track_sorted, prepend=-1) != 0]
+    last = order[np.diff(track_sorted, append=-1) != 0]
+
+    if pairs:
+        geometry = df.geometry
+        if geometry.crs is not None and not geometry.crs.is_geographic:
+            geometry = geometry.to_crs('epsg:4326')
+        lng = geometry.x.to_numpy()
+        lat = geometry.y.to_numpy()
+        datetimes = df['datetime'].array
+        return pd.DataFrame({
+            'track.id': tracks[track[first]],
+            'origin_time': datetimes.take(first),
+            'destination_time': datetimes.take(last),
+            'origin_lat': lat[first], 'origin_lng': lng[first],
+            'destination_lat': lat[last], 'destination_lng': lng[last],
+            'distance': _haversine(lng[first], lat[first], lng[last], lat[last]),
+            'duration': seconds[last] - seconds[first]})
+
+    def points_at(rows):
+        # all points at the time of 'rows' within their track, by track
+        time = np.full(len(tracks), np.nan)
+        time[track[rows]] = seconds[rows]
+        selected = np.flatnonzero((seconds == time[track]) & (track >= 0))
+        return df.iloc[selected[np.argsort(track[selected], kind='stable')]]
+
+    return points_at(first), points_at(last)
+
+def plotAggregate(grid, field, directory=None):
     """
     Plots the aggregated data on grid. Please call aggregateByGrid
         function before this step.
@@ -937,6 +1028,9 @@ def plotAggregate(grid, field):
         Grid shoud have grid id or equivalent unique ids
     field : string
         Fieldname with aggregated data
+    directory : string, optional
+        If given, grids.geojson and attributes.csv are written to this
+        directory. The map itself is built in memory. The default is None.
 
     Returns
     -------
@@ -944,21 +1038,27 @@ def plotAggregate(grid, field):
         Folium map with openstreetmap as base.
 
     """
-    # Prepare for grid plotting using folium
-    grid.columns = [cols.replace('.', '_') for cols in grid.columns]
+    # Prepare for grid plotting using folium, on a copy of the grid
+    grid = grid.rename(columns=lambda cols: cols.replace('.', '_'))
     field = field.replace('.', '_')
     # Convert grid id to string
     grid['gridId'] = grid['gridId'].astype(str)
 
-    # Convert data to geojson and csv
-    atts = pd.DataFrame(grid)
-    grid.to_file("grids.geojson", driver='GeoJSON')
-    atts.to_csv("attributes.csv", index=False)
+    # Optionally save grid as geojson and csv
+    if directory is not None:
+        grid.to_file(os.path.join(directory, "grids.geojson"), driver='GeoJSON')
+        pd.DataFrame(grid).to_csv(os.path.join(directory, "attributes.csv"),
+                                  index=False)
+
+    # construct color map
+    minvalue = grid[field].min()
+    maxvalue = grid[field].max()
+    colormap_rn = colormap.linear.YlOrRd_09.scale(minvalue, maxvalue)
 
-    # load spatial and non-spatial data
-    data_geojson_source = "grids.geojson"
-    # data_geojson=gpd.read_file(data_geojson_source)
-    data_geojson = json.load(open(data_geojson_source))
+    # Build geojson in memory, the color of every grid cell is stored as
+    # its property 'fillColor'
+    data_geojson = _grid_geojson(grid, ['gridId', field],
+                                 _fill_colors(grid[field], colormap_rn))
 
     # Get coordiantes for map centre
     lat = grid.geometry.centroid.y.mean()
@@ -975,20 +1075,6 @@ def plotAggregate(grid, field):
                                     'weight': 0.5,
                                     'fillOpacity': 0}).add_to(m)
 
-    # add attribute data
-    attribute_pd = pd.read_csv("attributes.csv")
-    attribute = pd.DataFrame(attribute_pd)
-    # Convert gridId to string to ensure it matches with gridId
-    attribute['gridId'] = attribute['gridId'].astype(str)
-
-    # construct color map
-    minvalue = attribute[field].min()
-    maxvalue = attribute[field].max()
-    colormap_rn = linear.YlOrRd_09.scale(minvalue, maxvalue)
-
-    # Create Dictionary for colormap
-    population_dict_rn = attribute.set_index('gridId')[field]
-
     # create map
     folium.GeoJson(
         data_geojson,
@@ -996,8 +1082,7 @@ def plotAggregate(grid, field):
         style_function=lambda feature: {
             'lineOpacity': 0,
             'color': 'green',
-            'fillColor': colormap_rn(
-                population_dict_rn[feature['properties']['gridId']]),
+            'fillColor': feature['properties']['fillColor'],
             'weight': 0,
             'fillOpacity': 0.6
         },
@@ -1018,7 +1103,8 @@ def plotAggregate(grid, field):
     return m
 
 
-def getClusters(positions, distanceKM, min_samples=5):
+def getClusters(positions, distanceKM, min_samples=5, cellKM=None,
+                chunkSize=100000, return_labels=False):
     """
     Returns the clusters from the points based on provided data to no. of
         clusters based on DBScan Algorithm
@@ -1034,62 +1120,111 @@ def getClusters(positions, distanceKM, min_samples=5):
         DESCRIPTION. Minimum no. of points required to form cluster.
             If 1 is set,each individual will form their own cluster
             The default is 5.
+    cellKM : Float, optional
+        Scalable mode for millions of points. Points are aggregated into
+            grid cells of cellKM x cellKM (e.g. distanceKM / 4), the
+            cells are clustered with their number of points as weight and
+            every point gets the label of its cell. Distances are exact
+            up to the cell diagonal. The neighbour graph holds at most
+            about pi * (distanceKM / cellKM + 1)^2 entries (16 bytes each)
+            per occupied cell, its memory depends on the covered area but
+            not on the number of points per area, the points themselves
+            only need a few arrays of length n. The default is None
+            (cluster every point).
+    chunkSize : Integer, optional
+        Number of cells whose neighbours are searched at once in the
+            scalable mode. The default is 100000.
+    return_labels : Boolean, optional
+        Return the cluster label of every point as well (-1 for noise).
+            The default is False.
 
     Returns
     -------
     Dataframe
         The dataframe with cluster centres co-ordinates and no. of points
             on the cluster.
+    Series
+        Only if return_labels is True. The clusterId of every point,
+            aligned to positions.
 
     """
-    def get_centermost_point(cluster):
-        centroid = (MultiPoint(cluster).centroid.x,
-                    MultiPoint(cluster).centroid.y)
-        centermost_point = min(
-            cluster, key=lambda point: great_circle(point, centroid).m)
-        return tuple(centermost_point)
-    df = positions.to_crs('epsg:4326')
-    lon = df.geometry.x
-    lat = df.geometry.y
-    origin_pt = pd.DataFrame()
-    # Populate lat lon to dataframe
-    origin_pt['lat'] = lat
-    origin_pt['lon'] = lon
-    # add index to data
-    coords = origin_pt.to_numpy()
-    origin_pt.index = [i for i in range(len(lat))]
+    geometry = positions.geometry.to_crs('epsg:4326')
+    lat = geometry.y.to_numpy()
+    lon = geometry.x.to_numpy()
+    coords = np.column_stack([lat, lon])
     #
     # Convert Data to projected and perform clustering
     kms_per_radian = 6371.0088
     epsilon = distanceKM / kms_per_radian
-    db = DBSCAN(eps=epsilon, min_samples=min_samples,
-                algorithm='ball_tree', metric='haversine').fit(
-                    np.radians(coords))
-    cluster_labels = db.labels_
-    validClusters = []
-    for cluster in cluster_labels:
-        if cluster != -1:
-            validClusters.append(cluster)
-    num_clusters = len(set(validClusters))
-    clusters = pd.Series([coords[cluster_labels == n]
-                          for n in range(num_clusters)])
-    # Assigining clusterId to each point
-    origin_pt['clusterId'] = cluster_labels
-    # Identify cluster Centres
-    centermost_points = clusters.map(get_centermost_point)
-
-    # Create Geodataframe with attributes for cluster centroids
-    clusterId = [i for i in range(len(centermost_points))]
-    centroidLat = [centermost_points[i][0]
-                   for i in range(len(centermost_points))]
-    centroidLon = [centermost_points[i][1]
-                   for i in range(len(centermost_points))]
-    clusterSize = [len(origin_pt[origin_pt['clusterId'] == i])
-                   for i in range(len(centermost_points))]
+    if cellKM is None:
+        db = sklearn_cluster.DBSCAN(eps=epsilon, min_samples=min_samples,
+                    algorithm='ball_tree', metric='haversine').fit(
+                        np.radians(coords))
+        cluster_labels = db.labels_
+    else:
+        cell, cellLat, cellLon, weight = _grid_cells(lat, lon, cellKM)
+        graph = _radius_graph(np.radians(np.column_stack([cellLat, cellLon])),
+                              epsilon, chunkSize)
+        db = sklearn_cluster.DBSCAN(eps=epsilon, min_samples=min_samples,
+                    metric='precomputed').fit(graph, sample_weight=weight)
+        cluster_labels = db.labels_[cell]
+    clusterCentres = _cluster_centres(lat, lon, cluster_labels)
+    if return_labels:
+        return clusterCentres, pd.Series(cluster_labels, index=positions.index,
+                                         name='clusterId')
+    return clusterCentres
+
+
+def _grid_cells(lat, lon, cellKM):
+    # Cell of every point on a grid of cellKM x cellKM (longitude steps are
+    # widened with the latitude of the row), mean position and number of
+    # points of every occupied cell
+    latStep = cellKM / (6371.0088 * np.pi / 180)
+    row = np.floor(lat / latStep).astype(np.int64)
+    lonStep = latStep / np.cos(np.radians((row + 0.5) * latStep))
+    column = np.floor(lon / lonStep).astype(np.int64)
+    cell, _ = pd.factorize(row * 2**32 + column)
+    weight = np.bincount(cell).astype(float)
+    return (cell, np.bincount(cell, lat) / weight,
+            np.bincount(cell, lon) / weight, weight)
+
+
+def _radius_graph(points, radius, chunkSize):
+    # Sparse matrix of the haversine distances of all pairs of points (lat,
+    # lon in radians) within radius, searched for chunkSize points at once
+    tree = sklearn_neighbors.BallTree(points, metric='haversine')
+    counts, indices, distances = [], [], []
+    for start in range(0, len(points), chunkSize):
+        neighbours, distance = tree.query_radius(
+            points[start:start + chunkSize], radius, return_distance=True)
+        counts.append(np.fromiter(map(len, neighbours), dtype=np.int64,
+                                  count=len(neighbours)))
+        indices.append(np.concatenate(neighbours))
+        distances.append(np.concatenate(distance))
+    indptr = np.concatenate([[0], np.cumsum(np.concatenate(counts))])
+    return scipy_sparse.csr_matrix(
+        (np.concatenate(distances), np.concatenate(indices), indptr),
+        shape=(len(points), len(points)))
+
+
+def _cluster_centres(lat, lon, labels):
+    # Centermost point and size of every cluster, noise (-1) is left out.
+    # The centroid is the mean of lat and lon, the centermost point the one
+    # with the smallest great circle distance to it (first one on ties).
+    valid = labels >= 0
+    lat, lon, labels = lat[valid], lon[valid], labels[valid]
+    num_clusters = labels.max() + 1 if len(labels) else 0
+    clusterSize = np.bincount(labels, minlength=num_clusters)
+    centroidLat = np.bincount(labels, lat, num_clusters) / clusterSize
+    centroidLon = np.bincount(labels, lon, num_clusters) / clusterSize
+    distance = _haversine(lon, lat, centroidLon[labels], centroidLat[labels])
+    order = np.lexsort((distance, labels))
+    centermost = order[np.searchsorted(labels[order], np.arange(num_clusters))]
+
     # Create dataframe for cluster centers
     clusterCentres_df = pd.DataFrame(
-        {'clusterId': clusterId, 'clusterLat': centroidLat,
-         'clusterLon': centroidLon, 'clusterSize': clusterSize})
+        {'clusterId': np.arange(num_clusters), 'clusterLat': lat[centermost],
+         'clusterLon': lon[centermost], 'clusterSize': clusterSize})
     clusterCentres = gpd.GeoDataFrame(clusterCentres_df,
                                       geometry=gpd.points_from_xy(
                                           clusterCentres_df.clusterLon,
@@ -1,12 +1,11 @@
 import pandas as pd
 import geopandas as gpd
-from scipy import stats
 import numpy as np
-import math
-import datetime
-import string
-import random
-import scipy as sc
+
+_EPOCH = pd.Timestamp(0, tz='UTC')
+EARTH_RADIUS_M = 6371008.8
+KINEMATIC_COLUMNS = ['Acceleration.value', 'Jerk.value', 'Distance.value',
+                     'Bearing (GPS-based).value', 'Speed (GPS-based).value']
 
 # class Manipulation():
 #     def __init__(self):
@@ -29,44 +28,141 @@ def calculateAcceleration(points_df):
             points
 
     Returns:
-        combined_again -- new GeoDataFrame with "Acceleration.value" column
+        points_df -- the input GeoDataFrame with "Acceleration.value" column
     """
+    return calculate_kinematics(points_df, ['Acceleration.value'])
 
-    points_df['t'] = pd.to_datetime(
-         points_df['time'], format='%Y-%m-%dT%H:%M:%S')
-
-    dict_of_tracks = dict(iter(points_df.groupby('track.id')))
 
-    for track_id in dict_of_tracks:
-        time_arr = dict_of_tracks[track_id]['t'].tolist()
-        speed_arr = dict_of_tracks[track_id]['Speed.value'].to_numpy()
-        acceleration_array = [0]
+def calculate_kinematics(points_df, columns=None):
+    """ Calculates kinematic variables of all tracks at once. Points are
+        sorted by track and time, differences are taken between neighbouring
+        points and reset at track boundaries. The original row order is kept.
 
-        for i in range(1, len(time_arr)):
-            # using speed not to calculate velocity because we don't care
-            # about direction anyway
-            velocity_change = speed_arr[i] - speed_arr[i-1]
-            time_change = (time_arr[i] - time_arr[i-1]).total_seconds()
+        Acceleration.value -- change of Speed.value per second (km/h/s)
+        Jerk.value -- change of Acceleration.value per second
+        Distance.value -- haversine distance to the previous point (m)
+        Bearing (GPS-based).value -- bearing from the previous point (deg)
+        Speed (GPS-based).value -- Distance.value over time passed (km/h)
 
-            if (time_change != 0):
-                acceleration = (velocity_change / time_change)
-            else:
-                acceleration = 0
+        Acceleration and jerk are 0 at the first point of a track and where
+        no time passed, speed is NaN there. Distance is 0 and bearing is NaN
+        at the first point of a track only.
 
-            # print(velocity_change, time_change, acceleration)
-            acceleration_array.append(acceleration)
+    Keyword Arguments:
+        points_df {GeoDataFrame} -- A GeoDataFrame containing the track
+            points
+        columns {list} -- names of the variables above to calculate,
+            all of them by default
 
-        dict_of_tracks[track_id]['Acceleration.value'] = acceleration_array
+    Returns:
+        points_df -- the input GeoDataFrame with the kinematic columns
+    """
+    if columns is None:
+        columns = KINEMATIC_COLUMNS
+
+    seconds = _epoch_seconds(points_df)
+    track, _ = pd.factorize(points_df['track.id'])
+    order = np.lexsort((seconds, track))
+
+    # neighbouring points which belong to the same track
+    track = track[order]
+    previous = np.r_[False, track[1:] == track[:-1]]
+    time_change = np.diff(seconds[order], prepend=np.nan)
+    valid = previous & (time_change > 0)
+
+    def change_per_second(values):
+        change = np.zeros(len(values))
+        change[valid] = (values[1:] - values[:-1])[valid[1:]] \
+            / time_change[valid]
+        return change
+
+    kinematics = {}
+    if {'Acceleration.value', 'Jerk.value'} & set(columns):
+        # using speed not to calculate velocity because we don't care
+        # about direction anyway
+        acceleration = change_per_second(
+            points_df['Speed.value'].to_numpy(dtype=float)[order])
+        kinematics['Acceleration.value'] = acceleration
+        if 'Jerk.value' in columns:
+            jerk = change_per_second(acceleration)
+            # the first acceleration of a track is not a measurement
+            jerk[~np.r_[False, valid[:-1]]] = 0
+            kinematics['Jerk.value'] = jerk
+
+    if {'Distance.value', 'Bearing (GPS-based).value',
+            'Speed (GPS-based).value'} & set(columns):
+        geometry = points_df.geometry
+        if geometry.crs is not None and not geometry.crs.is_geographic:
+            geometry = geometry.to_crs('epsg:4326')
+        lng = geometry.x.to_numpy()[order]
+        lat = geometry.y.to_numpy()[order]
+        lng_previous, lat_previous = np.roll(lng, 1), np.roll(lat, 1)
+
+        distance = _haversine(lng_previous, lat_previous, lng, lat)
+        distance[~previous] = 0
+        kinematics['Distance.value'] = distance
+        bearing = _bearing(lng_previous, lat_previous, lng, lat)
+        bearing[~previous] = np.nan
+        kinematics['Bearing (GPS-based).value'] = bearing
+        speed = np.full(len(distance), np.nan)
+        speed[valid] = distance[valid] / time_change[valid] * 3.6
+        kinematics['Speed (GPS-based).value'] = speed
+
+    for column in columns:
+        values = np.empty(len(order))
+        values[order] = kinematics[column]
+        points_df[column] = values
+    return points_df
+
+
+def _haversine(lng1, lat1, lng2, lat2):
+    """ Great circle distance in meters between points given in degrees,
+        works element-wise on arrays
+    """
+    lng1, lat1, lng2, lat2 = map(np.radians, (lng1, lat1, lng2, lat2))
+    a = np.sin((lat2 - lat1) / 2)**2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2)**2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
 
-    combined_again = pd.concat(dict_of_tracks.values())
 
-    return combined_again
+def _bearing(lng1, lat1, lng2, lat2):
+    """ Initial bearing in degrees (0-360) from the first to the second
+        point, works element-wise on arrays
+    """
+    lng1, lat1, lng2, lat2 = map(np.radians, (lng1, lat1, lng2, lat2))
+    y = np.sin(lng2 - lng1) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - \
+        np.sin(lat1) * np.cos(lat2) * np.cos(lng2 - lng1)
+    return np.degrees(np.arctan2(y, x)) % 360
 
 
 def add_column_datetime(df):
-    df['datetime'] = pd.to_datetime(df['time'])
+    """ Parses the ISO 8601 'time' column once into the UTC datetime64
+        column 'datetime'. All functions which need timestamps reuse this
+        column, so the strings are only parsed if it does not exist yet.
+        UTC offsets in the strings are taken into account.
+
+    Keyword Arguments:
+        df {GeoDataFrame} -- A GeoDataFrame containing the track points
+
+    Returns:
+        df -- the input GeoDataFrame with "datetime" column
+    """
+    if not ('datetime' in df.columns and
+            isinstance(df['datetime'].dtype, pd.DatetimeTZDtype)):
+        df['datetime'] = pd.to_datetime(df['time'], utc=True,
+                                        format='ISO8601')
     return df
 
+
+def _epoch_seconds(df):
+    """ Returns the timestamps of df as float seconds since 1970-01-01 UTC,
+        based on the shared "datetime" column
+    """
+    datetimes = add_column_datetime(df)['datetime']
+    return ((datetimes - _EPOCH) / pd.Timedelta(seconds=1)).to_numpy()
+
+
 def add_coordinate_columns(df):
     df['lat'] = df['geometry'].apply(lambda coord: coord.y)
     df['lng'] = df['geometry'].apply(lambda coord: coord.x)
@@ -133,34 +229,16 @@ def split_by_time(points_df, seconds_start, seconds_end):
         combined_again -- Some part of the tracks
     """
 
-    def seconds_since_start(x, start):
-        # print(x, start)
-        if (isinstance(x, str)):
-            x = datetime.datetime.strptime(x, '%Y-%m-%dT%H:%M:%S')
-        seconds = (x-start).total_seconds()
-        return int(seconds)
-
-    dict_of_tracks = dict(iter(points_df.groupby('track.id')))
-    beginnings = []
-
-    for track_id in dict_of_tracks:
-        start_time = datetime.datetime.strptime(
-            dict_of_tracks[track_id].time.iloc[0], '%Y-%m-%dT%H:%M:%S')
-
-        dict_of_tracks[track_id]['Seconds since start'] = \
-            np.vectorize(seconds_since_start)(
-                np.array(dict_of_tracks[track_id]['time'].values.tolist()),
-                start_time)
-
-        beginning = dict_of_tracks[track_id][(dict_of_tracks[track_id]
-                                             ['Seconds since start']
-                                             < seconds_end) &
-                                             (dict_of_tracks[track_id]
-                                             ['Seconds since start']
-                                             > seconds_start)]
-        beginnings.append(beginning)
+    seconds = pd.Series(_epoch_seconds(points_df), index=points_df.index)
+    seconds = seconds - seconds.groupby(
+        points_df['track.id']).transform('first')
+    # whole seconds as before, kept as float so that points without track
+    # id (NaN) fail the comparison and are skipped
+    seconds = np.trunc(seconds)
+    mask = (seconds < seconds_end) & (seconds > seconds_start)
 
-    combined_again = pd.concat(beginnings)
+    combined_again = points_df[mask].copy()
+    combined_again['Seconds since start'] = seconds[mask].astype(int)
 
     return combined_again
 
@@ -168,6 +246,12 @@ def split_by_time(points_df, seconds_start, seconds_end):
 def interpolate(points, step_type="meters", step_pr=10):
     """ Interpolates points
 
+        All tracks are resampled together: the travelled distance is a
+        cumulative sum per track and all interpolated columns are computed
+        in one linear interpolation of the value matrix. Every track is
+        resampled in steps of exactly 1 (step_pr meters or 1 second) from
+        its first to its last point.
+
     Keyword Arguments:
         points {GeoDataFrame} -- A GeoDataFrame containing the track points
         step_type {string} -- either "meters" or "seconds"
@@ -176,173 +260,112 @@ def interpolate(points, step_type="meters", step_pr=10):
     Returns:
         new_points -- An interpolated trajectory
     """
-
-    def date_to_seconds(x):
-        date_time_obj = datetime.datetime.strptime(x, '%Y-%m-%dT%H:%M:%S+00:00')
-        seconds = (date_time_obj-datetime.datetime(1970, 1, 1)
-                   ).total_seconds()
-        return int(seconds)
-
-    def seconds_to_date(x):
-        date = datetime.datetime.fromtimestamp(x, datetime.timezone.utc)
-        return date
-
-    def randStr(chars=string.ascii_uppercase + string.digits, N=24):
-        return ''.join(random.choice(chars) for _ in range(N))
-
-    def interpolate_coords(x, input_array, step):
-        # interpolations_methods = ['slinear', 'quadratic', 'cubic']
-        points = np.array(input_array).T
-        interpolator = sc.interpolate.interp1d(x, points, kind='slinear',
-                                            axis=0)
-        ynew = interpolator(step)
-        transposed = ynew.T
-        return_values = [np.array(transposed[0]), np.array(transposed[1])]
-
-        # # spline interpolation works better but takes different
-        # # steps as an input, thus shifting all the points
-        # step_norm = (step-min(step))/(max(step)-min(step))
-        # tck, u = interpolate.splprep(input_array, s=0)
-        # interpolated = interpolate.splev(step_norm, tck)
-
-        return return_values
-
-    def interpolate_linear(x, y, xnew):
-        f = sc.interpolate.interp1d(x, y)
-        values_new = f(xnew)
-        return values_new
-
     print('Amount of points before interpolation',
           points.shape)
 
+    # to interpolate for every meter or every 10 meters
+    if (step_pr != 1):
+        step_pr = 10
+
     # to have flat attributes for coordinates
-    points['lat'] = points['geometry'].apply(lambda coord: coord.y)
-    points['lng'] = points['geometry'].apply(lambda coord: coord.x)
-    points_df = pd.DataFrame(points)
-
-    tracks_dict = dict(iter(points_df.groupby('track.id')))
-    interpolated = []
-
-    for track_id in tracks_dict:
-        # removing duplicates because interpolation won't work otherwise
-        points_df_cleaned = tracks_dict[track_id].drop_duplicates(
-            ['lat', 'lng'], keep='last')
-
-        # input for datetime in seconds
-        points_df_cleaned['time_seconds'] = np.vectorize(date_to_seconds)(
-            np.array(points_df_cleaned.time.values.tolist()))
-
-        # creating the column name lists
-        names_interpolate = [s for s in points_df_cleaned.columns if
-                             '.value' in s]
-        # adding the other column names at front
-        names_interpolate = ['lng', 'lat', 'time_seconds'] + \
-            names_interpolate
-        names_replicatate = np.setdiff1d(points_df_cleaned.columns,
-                                         names_interpolate)
-        names_extra = ['geometry', 'id', 'time']
-        names_replicatate = [x for x in names_replicatate if x
-                             not in names_extra]
-
-        time_seconds_array = points_df_cleaned[
-                'time_seconds'].to_numpy()
-
-        passed_time = [(time_seconds_array[i+1]-time_seconds_array[i])
-                       for i in range(len(time_seconds_array)-1)]
-        passed_time = np.insert(passed_time, 0, 0, axis=0)
-        # to interpolate for every meter or every 10 meters
-        if (step_pr != 1):
-            step_pr = 10
-        dist = (points_df_cleaned['Speed.value']/3.6 * passed_time)/step_pr
-        dist_between = [sum(dist[:i+1]) for i in range(len(dist))]
-        dist_between = list(map(int, dist_between))
-        # print(dist_between)
-
-        points_df_cleaned['dist_between'] = dist_between
-
-        points_df_cleaned.drop_duplicates(
-            ['dist_between'], keep='first', inplace=True)
-
-        dist_between = np.array(
-            points_df_cleaned['dist_between'].values.tolist())
-        # print(dist_between)
-
-        del points_df_cleaned['dist_between']
-        # measurements themselves
-        columns_interpolate = [np.array(
-            points_df_cleaned[column].values.tolist()) for column
-            in names_interpolate]
-
-        # split dataframe because splprep cannot take more than 11
-        dfs = np.split(columns_interpolate, [2], axis=0)
-
-        """ Interpolation itself """
-        # Find the B-spline representation of the curve
-        # tck (t,c,k): is a tuple containing the vector of knots,
-        # the B-spline coefficients, and the degree of the spline.
-        # u: is an array of the values of the parameter.
-
-        if (step_type == 'seconds'):
-            step_interp = np.linspace(
-                points_df_cleaned['time_seconds'].iloc[0],
-                points_df_cleaned['time_seconds'].iloc[-1],
-                points_df_cleaned['time_seconds'].iloc[-1]
-                - points_df_cleaned['time_seconds'].iloc[0])
-            step_original = np.array(
-                points_df_cleaned['time_seconds'].values.tolist())
-        else:
-            step_interp = np.linspace(dist_between[0],
-                                      dist_between[-1],
-                                      dist_between[-1] -
-                                      dist_between[0],
-                                      dtype='int32')
-            step_original = dist_between
-
-        new_points = interpolate_coords(step_original, dfs[0], step_interp)
-
-        for idx, column in enumerate(dfs[1]):
-            new_points.append(interpolate_linear(step_original, column,
-                                                 step_interp))
-
-        # transposing the resulting matrix to fit it in the dataframe
-        data = np.transpose(new_points)
-
-        # constructing the new dataframe
-        interpolated_df = pd.DataFrame(data)
-
-        interpolated_df.columns = names_interpolate
-        interpolated_df['time'] = np.vectorize(
-            seconds_to_date)(interpolated_df['time_seconds'])
-
-        # these should all be the same for one ride, so just replicating
-        columns_replicate = [np.repeat(points_df_cleaned[column].iloc[0],
-                             len(step_interp)) for column
-                             in names_replicatate]
-
-        replicated_transposed = np.transpose(columns_replicate)
-        replicated_df = pd.DataFrame(replicated_transposed)
-        replicated_df.columns = names_replicatate
-
-        # combining replicated with interpolated
-        full_df = pd.concat([interpolated_df, replicated_df], axis=1,
-                            sort=False)
-
-        # adding ids
-        full_df['id'] = 0
-        for row in full_df.index:
-            full_df['id'][row] = randStr()
-
-        # transforming back to a geodataframe
-        full_gdf = gpd.GeoDataFrame(
-            full_df, geometry=gpd.points_from_xy(full_df.lng, full_df.lat))
-
-        # remove full_gdf['lng'], full_gdf['lat'] ?
-        del full_gdf['time_seconds']
-
-        # print(full_gdf['track.length'])
-        interpolated.append(full_gdf)
-
-        combined_again = pd.concat(interpolated)
+    points_df = pd.DataFrame(points.drop(columns='geometry'))
+    points_df['lat'] = points.geometry.y.to_numpy()
+    points_df['lng'] = points.geometry.x.to_numpy()
+    # input for datetime in seconds
+    points_df['time_seconds'] = _epoch_seconds(points)
+
+    # creating the column name lists
+    names_interpolate = ['lng', 'lat', 'time_seconds'] + \
+        [s for s in points_df.columns if '.value' in s]
+    names_extra = ['id', 'time', 'datetime']
+    names_replicatate = [x for x in np.setdiff1d(points_df.columns,
+                                                 names_interpolate)
+                         if x not in names_extra]
+
+    points_df = points_df[points_df['track.id'].notna() &
+                          points_df['time_seconds'].notna()]
+    # tracks one after another, points of a track keep their order
+    track = pd.factorize(points_df['track.id'], sort=True)[0]
+    points_df = points_df.iloc[np.argsort(track, kind='stable')]
+    # removing duplicates because interpolation won't work otherwise
+    points_df = points_df[~points_df.duplicated(['track.id', 'lat', 'lng'],
+                                                keep='last')]
+    track = pd.factorize(points_df['track.id'], sort=True)[0]
+
+    # travelled distance in steps of step_pr, accumulated per track
+    passed_time = points_df['time_seconds'].diff().to_numpy(copy=True)
+    passed_time[np.r_[True, track[1:] != track[:-1]]] = 0
+    dist = (points_df['Speed.value'].to_numpy() / 3.6 * passed_time) / step_pr
+    dist_between = pd.Series(np.nan_to_num(dist)).groupby(track).cumsum()
+    points_df['dist_between'] = dist_between.to_numpy().astype(np.int64)
+    points_df = points_df.drop_duplicates(['track.id', 'dist_between'],
+                                          keep='first')
+
+    if (step_type == 'seconds'):
+        step_column = 'time_seconds'
+    else:
+        step_column = 'dist_between'
+    track, track_ids = pd.factorize(points_df['track.id'], sort=True)
+    order = np.lexsort((points_df[step_column].to_numpy(), track))
+    points_df = points_df.iloc[order]
+    track = track[order]
+    step_original = points_df[step_column].to_numpy(dtype=float)
+
+    # steps of 1 from the first to the last point of every track
+    starts = np.flatnonzero(np.r_[True, track[1:] != track[:-1]])
+    ends = np.r_[starts[1:], len(track)]
+    counts = (np.floor(step_original[ends - 1]) -
+              np.ceil(step_original[starts])).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(starts)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                   counts)
+    step_interp = np.ceil(step_original[starts])[segment] + position
+
+    """ Interpolation itself """
+    values = points_df[names_interpolate].to_numpy(dtype=float)
+    interpolated_df = pd.DataFrame(
+        _interpolate_linear(step_original, values, starts, ends,
+                            step_interp, segment),
+        columns=names_interpolate)
+    interpolated_df['time'] = pd.to_datetime(
+        np.round(interpolated_df['time_seconds'].to_numpy() * 1000)
+        .astype(np.int64), unit='ms', utc=True)
+
+    # these should all be the same for one ride, so just replicating
+    replicated_df = points_df[names_replicatate].iloc[starts[segment]]
+    full_df = pd.concat([interpolated_df,
+                         replicated_df.reset_index(drop=True)], axis=1)
+
+    # adding ids, made of the track id and the number of the step
+    prefixes = pd.Series(track_ids).astype(str) + '_'
+    full_df['id'] = (prefixes.iloc[track[starts][segment]].to_numpy() +
+                     pd.Series(position).astype(str).to_numpy())
+    del full_df['time_seconds']
+
+    # transforming back to a geodataframe
+    combined_again = gpd.GeoDataFrame(
+        full_df, geometry=gpd.points_from_xy(full_df.lng, full_df.lat),
+        crs=points.crs)
     print('Amount of points after interpolation',
           combined_again.shape)
     return combined_again
+
+
+def _interpolate_linear(x, values, starts, ends, x_new, segment):
+    """ Linear interpolation of all columns of values at once. x is sorted
+        within segments [starts, ends), every x_new is interpolated within
+        its own segment only.
+    """
+    # shift segments apart so that x is sorted over all segments
+    shift = np.cumsum(np.r_[0, (x[ends - 1] - x[starts] + 1)[:-1]]) - \
+        x[starts]
+    position = np.searchsorted(x + np.repeat(shift, ends - starts),
+                               x_new + shift[segment], side='right') - 1
+
+    low = np.clip(position, starts[segment],
+                  np.maximum(ends[segment] - 2, starts[segment]))
+    high = np.minimum(low + 1, ends[segment] - 1)
+    span = x[high] - x[low]
+    weight = np.divide(x_new - x[low], span, out=np.zeros(len(x_new)),
+                       where=span > 0)[:, None]
+    return values[low] * (1 - weight) + values[high] * weight
@@ -0,0 +1,174 @@
+import pandas as pd
+import numpy as np
+
+
+class MissingProfile:
+    '''
+        Aim:
+            Number of missing values per group and variable together with
+            the number of rows per group. Profiles of chunks of a dataset
+            (or of different workers) can be merged, proportions are only
+            derived from the merged counts.
+
+        Input:
+            counts {DataFrame} -- missing values, one row per group and one
+                column per variable
+            rows {Series} -- number of rows per group
+    '''
+
+    def __init__(self, counts, rows):
+        self.counts = counts
+        self.rows = rows
+
+    def __repr__(self):
+        return 'MissingProfile({} groups, {} variables, {} rows)'.format(
+            len(self.rows), self.counts.shape[1], int(self.rows.sum()))
+
+    @classmethod
+    def from_frame(cls, df, by='track.id', columns=None):
+        '''
+            Aim:
+                Profile of a DF. isna() is computed once as boolean matrix
+                and reduced with one grouped sum.
+            Input:
+                DF,
+                optional: column to group by, None for one group 'all',
+                optional: list of variables (default: all columns but 'by')
+            Output:
+                MissingProfile
+        '''
+        if columns is None:
+            columns = [column for column in df.columns if column != by]
+        missing = df[columns].isna()
+        if by is None:
+            counts = missing.sum().to_frame('all').T
+            rows = pd.Series([len(df)], index=counts.index)
+        else:
+            keys = df[by].to_numpy()
+            counts = missing.groupby(keys).sum()
+            rows = pd.Series(keys).groupby(keys).size()
+            counts.index.name = by
+        rows.index.name = counts.index.name
+        return cls(counts.astype('int64'), rows.astype('int64'))
+
+    def merge(self, *others):
+        '''
+            Aim:
+                Combine the profiles of several chunks, counts and rows of
+                groups which occur in more than one chunk are added up
+            Input:
+                one or more MissingProfile
+            Output:
+                MissingProfile
+        '''
+        profiles = [self] + list(others)
+        counts = pd.concat([profile.counts for profile in profiles])
+        counts = counts.groupby(level=0, sort=False).sum().astype('int64')
+        rows = pd.concat([profile.rows for profile in profiles])
+        rows = rows.groupby(level=0, sort=False).sum().astype('int64')
+        counts.index.name = rows.index.name = self.counts.index.name
+        return MissingProfile(counts, rows)
+
+    def proportions(self):
+        '''
+            Missing values in percent of the rows of each group
+        '''
+        return self.counts.div(self.rows, axis=0) * 100
+
+    def per_variable(self):
+        '''
+            Aim:
+                Totals over all groups
+            Output:
+                Pandas DF with columns 'column', 'missing_values' and
+                'missing_values(%)' in the order of the variables
+        '''
+        total = self.counts.sum()
+        return pd.DataFrame({'column': total.index,
+                             'missing_values': total.to_numpy(),
+                             'missing_values(%)': total.to_numpy() /
+                             self.rows.sum() * 100})
+
+
+def merge_missing_profiles(profiles):
+    '''
+        Merge a list of MissingProfile, e.g. one per chunk of a dataset
+    '''
+    profiles = list(profiles)
+    return profiles[0].merge(*profiles[1:])
+
+
+def missing_patterns(df, columns=None):
+    '''
+        Aim:
+            Encode which variables of a row are missing as one integer,
+            bit i is set if columns[i] is missing
+        Input:
+            DF,
+            optional: list of at most 64 variables (default: all '.value'
+                columns)
+        Output:
+            Pandas Series of uint64 aligned to the input,
+            list of the variables in bit order
+    '''
+    if columns is None:
+        columns = df.filter(like='.value').columns.to_list()
+    if len(columns) > 64:
+        raise ValueError('At most 64 variables fit into a pattern, got {}'
+                         .format(len(columns)))
+    missing = df[columns].isna().to_numpy()
+    packed = np.zeros((len(df), 8), dtype=np.uint8)
+    packed[:, :(len(columns) + 7) // 8] = np.packbits(
+        missing, axis=1, bitorder='little')
+    return pd.Series(packed.view('<u8').ravel(), index=df.index), columns
+
+
+def decode_missing_pattern(pattern, columns):
+    '''
+        Variables which are missing in a pattern of missing_patterns
+    '''
+    pattern = int(pattern)
+    return [column for i, column in enumerate(columns) if pattern >> i & 1]
+
+
+def missing_pattern_frequencies(df, by=None, columns=None):
+    '''
+        Aim:
+            Frequency of the combinations of missing variables (patterns),
+            e.g. to see which sensors are missing together. All patterns
+            are counted in one pass, only the distinct patterns are decoded.
+        Input:
+            DF,
+            optional: column or list of columns to count the patterns per
+                group, e.g. ['sensor.manufacturer', 'sensor.model'] or
+                'track.id',
+            optional: list of variables (default: all '.value' columns)
+        Output:
+            Pandas DF with the groups, 'pattern', 'rows', 'rows(%)' (of the
+            rows of the group), 'missing_count' and 'missing_variables',
+            sorted by the number of rows of the pattern in each group
+    '''
+    patterns, columns = missing_patterns(df, columns)
+    if by is None:
+        by = []
+    elif isinstance(by, str):
+        by = [by]
+
+    keys = [df[column] for column in by] + [patterns.rename('pattern')]
+    frequencies = patterns.groupby(keys, sort=False, dropna=False).size() \
+        .rename('rows').reset_index()
+    if by:
+        groupRows = frequencies.groupby(by, sort=False, dropna=False)['rows'] \
+            .transform('sum')
+    else:
+        groupRows = len(df)
+    frequencies['rows(%)'] = frequencies['rows'] / groupRows * 100
+
+    decoded = {pattern: decode_missing_pattern(pattern, columns)
+               for pattern in frequencies['pattern'].unique()}
+    frequencies['missing_count'] = frequencies['pattern'].map(
+        {pattern: len(names) for pattern, names in decoded.items()})
+    frequencies['missing_variables'] = frequencies['pattern'].map(
+        {pattern: ', '.join(names) for pattern, names in decoded.items()})
+    return frequencies.sort_values(by + ['rows'], ascending=[True] * len(by) + [False]) \
+        .reset_index(drop=True)
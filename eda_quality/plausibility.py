@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy as np
+
+
+class RangeRule:
+    '''
+        Aim:
+            Declare the plausible range of variables. A rule either names
+            its '.value' columns or a unit, then it applies to every
+            '.value' column whose '.unit' column holds that unit. Values
+            outside [lower, upper] violate the rule, NaN never does.
+
+        Input:
+            name {str} -- name of the rule, used for counts and flags
+            lower {float} -- smallest plausible value, None for no bound
+            upper {float} -- largest plausible value, None for no bound
+            columns {str or list} -- '.value' columns the rule applies to
+            unit {str} -- unit the rule applies to, e.g. '%'
+    '''
+
+    def __init__(self, name, lower=None, upper=None, columns=None, unit=None):
+        if (columns is None) == (unit is None):
+            raise ValueError("Rule '{}' needs either 'columns' or 'unit'"
+                             .format(name))
+        if isinstance(columns, str):
+            columns = [columns]
+        self.name = name
+        self.lower = -np.inf if lower is None else lower
+        self.upper = np.inf if upper is None else upper
+        self.columns = columns
+        self.unit = unit
+
+    def __repr__(self):
+        target = "unit='{}'".format(self.unit) if self.unit is not None \
+            else 'columns={}'.format(self.columns)
+        return "RangeRule('{}', {}, {}, {})".format(
+            self.name, self.lower, self.upper, target)
+
+    def resolve(self, df, units):
+        '''
+            '.value' columns of the DF the rule applies to
+        '''
+        if self.unit is not None:
+            return [column for column, unit in units.items()
+                    if unit == self.unit and column in df.columns]
+        return [column for column in self.columns if column in df.columns]
+
+
+PERCENTAGE_RULE = RangeRule('faulty_percentages', 0, 100, unit='%')
+NON_NEGATIVE_RULE = RangeRule('implausible_neg_value', lower=0,
+                              columns=['Speed.value',
+                                       'CO2.value',
+                                       'Rpm.value',
+                                       'Consumption (GPS-based).value',
+                                       'Consumption.value',
+                                       'CO2 Emission (GPS-based).value'])
+MAX_SPEED_RULE = RangeRule('speedExceeds250km_h', upper=250,
+                           columns='Speed.value')
+
+PLAUSIBILITY_RULES = [PERCENTAGE_RULE, NON_NEGATIVE_RULE, MAX_SPEED_RULE]
+
+
+def column_units(df):
+    '''
+        Aim:
+            Unit of every '.value' column, taken from the first non-missing
+            entry of the matching '.unit' column
+        Input:
+            DF
+        Output:
+            dict which maps '.value' column to unit
+    '''
+    units = {}
+    for col in df.filter(like='.unit').columns:
+        # Units are constant within a column, usually the head is enough
+        known = df[col].iloc[:1000].dropna()
+        if known.empty:
+            known = df[col].dropna()
+        if len(known):
+            units[col.split(".")[0] + '.value'] = known.iloc[0]
+    return units
+
+
+def evaluate_rules(df, rules=None, chunkSize=1000000):
+    '''
+        Aim:
+            Check all rules in one vectorized pass. The columns of all rules
+            are read once as numeric block and compared against the bounds
+            of all (rule, column) pairs at the same time, rows are processed
+            in chunks to bound the memory of the comparison.
+        Input:
+            DF,
+            optional: list of RangeRule (default: PLAUSIBILITY_RULES),
+            optional: number of rows per chunk
+        Output:
+            Pandas Series with the number of violations per (rule, column),
+            Pandas DF of booleans aligned to the input with one column per
+                (rule, column), True where the value violates the rule
+    '''
+    if rules is None:
+        rules = PLAUSIBILITY_RULES
+    units = column_units(df) if any(rule.unit is not None for rule in rules) \
+        else {}
+
+    pairs, lower, upper = [], [], []
+    for rule in rules:
+        for column in rule.resolve(df, units):
+            pairs.append((rule.name, column))
+            lower.append(rule.lower)
+            upper.append(rule.upper)
+    names = list(dict.fromkeys(column for _, column in pairs))
+    position = np.array([names.index(column) for _, column in pairs],
+                        dtype=int)
+    lower = np.array(lower, dtype=float)
+    upper = np.array(upper, dtype=float)
+
+    values = df[names].to_numpy(dtype=float)
+    violation = np.zeros((len(df), len(pairs)), dtype=bool)
+    for start in range(0, len(df), chunkSize):
+        rows = slice(start, start + chunkSize)
+        block = values[rows][:, position]
+        violation[rows] = (block < lower) | (block > upper)
+
+    columns = pd.MultiIndex.from_tuples(pairs, names=['rule', 'column'])
+    masks = pd.DataFrame(violation, index=df.index, columns=columns, dtype=bool)
+    counts = pd.Series(violation.sum(axis=0), index=columns, dtype='int64')
+    return counts, masks
+
+
+def violating_rows(masks, rule=None):
+    '''
+        Aim:
+            Rows which violate a rule in any of its columns
+        Input:
+            masks DF as returned by evaluate_rules,
+            optional: rule name (default: any rule)
+        Output:
+            Boolean Series aligned to the input of evaluate_rules
+    '''
+    if rule is not None:
+        masks = masks.loc[:, masks.columns.get_level_values('rule') == rule]
+    return pd.Series(masks.to_numpy(dtype=bool).any(axis=1), index=masks.index)
@@ -4,8 +4,20 @@ from pip._internal.req import parse_requirements
 from setuptools import setup, find_packages
 
 # loading requirements
-requirements = list(parse_requirements('requirements.txt', session='hack'))
-requirements = [r.requirement for r in requirements]
+def load_requirements(path):
+    requirements = list(parse_requirements(path, session='hack'))
+    return [r.requirement for r in requirements]
+
+
+requirements = load_requirements('requirements.txt')
+
+# plotting and clustering dependencies are optional, a headless install
+# only needs the core requirements
+extras = {
+    'viz': load_requirements('requirements-viz.txt'),
+    'cluster': load_requirements('requirements-cluster.txt'),
+}
+extras['all'] = extras['viz'] + extras['cluster']
 
 
 def parse_long_description():
@@ -26,6 +38,7 @@ setup(
     url="https://github.com/enviroCar/envirocar-py",
     keywords=["enviroCar", "trajectory", "xFCD"],
     install_requires=requirements,
+    extras_require=extras,
     test_suite="tests",
     classifiers=[
         'Development Status :: 3 - Alpha',
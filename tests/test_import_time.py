@@ -0,0 +1,41 @@
+import subprocess
+import sys
+import unittest
+
+
+IMPORT_BUDGET_SECONDS = 2.0
+# Optional or slow dependencies which are only imported on first use
+LAZY_MODULES = ['seaborn', 'matplotlib', 'plotly', 'folium', 'branca',
+                'sklearn', 'scipy.stats', 'scipy.spatial', 'scipy.sparse']
+
+SCRIPT = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import eda_quality\n"
+    "print(time.perf_counter() - start)\n"
+    "print(','.join(m for m in {} if m in sys.modules))".format(LAZY_MODULES)
+)
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def setUp(self):
+        output = subprocess.run([sys.executable, '-c', SCRIPT],
+                                capture_output=True, text=True,
+                                check=True).stdout.splitlines()
+        self.import_time = float(output[0])
+        self.loaded = [module for module in output[1].split(',') if module]
+
+    def test_lazy_modules_not_imported(self):
+        self.assertEqual(self.loaded, [],
+                         'eda_quality imports {} at import time'.format(
+                             self.loaded))
+
+    def test_import_time_budget(self):
+        self.assertLess(self.import_time, IMPORT_BUDGET_SECONDS,
+                        'import eda_quality took {:.2f} s, budget is {} s'
+                        .format(self.import_time, IMPORT_BUDGET_SECONDS))
+
+
+if __name__ == '__main__':
+    unittest.main()
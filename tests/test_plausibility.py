@@ -0,0 +1,57 @@
+import contextlib
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import eda_quality
+
+
+def _points():
+    return pd.DataFrame({
+        'track.id': ['a', 'a', 'b', 'b'],
+        'Speed.value': [10.0, 260.0, -5.0, 30.0],
+        'Speed.unit': ['km/h'] * 4,
+        'Engine Load.value': [50.0, 120.0, 20.0, np.nan],
+        'Engine Load.unit': ['%'] * 4})
+
+
+class NoMatchingColumnsTest(unittest.TestCase):
+    '''
+        Rules whose columns are not in the DF (e.g. no '%' unit columns
+        after drop_unit_columns) find no violations instead of failing
+    '''
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.df = eda_quality.drop_unit_columns(_points())
+
+    def test_evaluate_rules_returns_bool_masks(self):
+        counts, masks = eda_quality.evaluate_rules(
+            self.df, [eda_quality.PERCENTAGE_RULE])
+        self.assertEqual(masks.shape, (4, 0))
+        self.assertEqual(counts.sum(), 0)
+        self.assertFalse(eda_quality.violating_rows(masks).any())
+
+    def test_flag_faulty_percentages(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = eda_quality.flag_faulty_percentages(self.df, dropColumns=False)
+        self.assertEqual(df['faulty_percentages'].tolist(), [0, 0, 0, 0])
+        self.assertEqual(df['Engine Load.value'].iloc[1], 120.0)
+
+    def test_flag_implausible_negative_values(self):
+        df = self.df.drop(columns='Speed.value')
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = eda_quality.flag_implausible_negative_values(df, setToNan=True)
+        self.assertEqual(df['implausible_neg_value'].tolist(), [0, 0, 0, 0])
+
+    def test_flag_faulty_percentages_with_units(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = eda_quality.flag_faulty_percentages(_points())
+        self.assertEqual(df['faulty_percentages'].tolist(), [0, 1, 0, 0])
+        self.assertTrue(np.isnan(df['Engine Load.value'].iloc[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()